@@ -18,6 +18,8 @@ from __future__ import annotations
 import argparse
 import copy
 import math
+import operator
+import os
 import random
 import re
 import sys
@@ -38,6 +40,8 @@ from boxes import gears
 from boxes import parts
 from boxes import pulley
 from boxes import svgutil
+from boxes import toolpath
+from boxes.drawing import polyline_segment
 from boxes.Color import *
 
 import qrcode
@@ -127,6 +131,7 @@ class NutHole:
         self.boxes = boxes
         self.ctx = boxes.ctx
         self.settings = settings
+        edges.bind_turtle(self, boxes)
 
     def __getattr__(self, name):
         return getattr(self.boxes, name)
@@ -212,6 +217,41 @@ class ArgparseEdgeType:
                          for e in self.edges) +
                 '      </param>\n')
 
+class ArgparseFormats:
+    """argparse type for a comma separated list of output formats"""
+
+    def __init__(self, choices) -> None:
+        self.choices = list(choices)
+
+    def __call__(self, arg):
+        result = []
+        for fmt in arg.split(","):
+            fmt = fmt.strip()
+            if fmt not in self.choices:
+                raise argparse.ArgumentTypeError(
+                    "invalid format %r (choose from %s)" % (
+                        fmt, ", ".join(self.choices)))
+            if fmt not in result:
+                result.append(fmt)
+        if "svg_Ponoko" in result and len(result) > 1:
+            raise argparse.ArgumentTypeError(
+                "svg_Ponoko can't be combined with other formats")
+        return ",".join(result)
+
+    def html(self, name, default, translate):
+        options = "\n".join(
+            """<option value="%s"%s>%s</option>""" %
+             (e, ' selected="selected"' if e == default else "",
+              translate(e)) for e in self.choices)
+        return """<select name="%s" id="%s" aria-labeledby="%s %s" size="1">\n%s</select>\n""" % (name,  name, name+"_id", name+"_description", options)
+
+    def inx(self, name, viewname, arg):
+        return ('        <param name="%s" type="optiongroup" appearance="combo" gui-text="%s" gui-description=%s>\n' %
+                (name, viewname, quoteattr(arg.help or "")) +
+                ''.join('            <option value="%s">%s</option>\n' % (e, e)
+                         for e in self.choices) +
+                '      </param>\n')
+
 class BoolArg:
     def __call__(self, arg):
         if not arg or arg.lower() in ("none", "0", "off", "false"):
@@ -288,6 +328,10 @@ class Boxes:
     UI = ""
 
     description: str = ""  # Markdown syntax is supported
+    # draw the parts placed by partsMatrix() by replaying the context
+    # calls of the first one (see _record()). The result is the same as
+    # long as the parts only depend on what _record() can check
+    replay_parts = True
 
     def __init__(self) -> None:
         self.formats = formats.Formats()
@@ -298,6 +342,7 @@ class Boxes:
         self.argparser = ArgumentParser(description=description)
         self.edgesettings: dict[Any, Any] = {}
         self.inkscapefile = None
+        self.output_formats: list[str] = []
         self.non_default_args: dict[Any, Any] = {}
         self.translations = gettext.NullTranslations()
 
@@ -325,9 +370,9 @@ class Boxes:
             "--output", action="store", type=str, default="box.svg",
             help="name of resulting file")
         defaultgroup.add_argument(
-            "--format", action="store", type=str, default="svg",
-            choices=self.formats.getFormats(),
-            help="format of resulting file [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#format)")
+            "--format", action="store", default="svg",
+            type=ArgparseFormats(self.formats.getFormats()),
+            help="format of resulting file (several formats separated by commas are written to files with the respective endings) [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#format)")
         defaultgroup.add_argument(
             "--tabs", action="store", type=float, default=0.0,
             help="width of tabs holding the parts in place (in mm)(not supported everywhere) [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#tabs)")
@@ -350,6 +395,30 @@ class Boxes:
         defaultgroup.add_argument(
             "--burn", action="store", type=float, default=0.1,
             help='burn correction (in mm)(bigger values for tighter fit) [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#burn)')
+        defaultgroup.add_argument(
+            "--optimize_travel", action="store", type=boolarg, default=False,
+            help="reorder the cuts to shorten the moves of the laser head in between [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#optimize-travel)")
+        defaultgroup.add_argument(
+            "--join_paths", action="store", type=boolarg, default=False,
+            help="join lines meeting at their ends to cut them in one go [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#join-paths)")
+        defaultgroup.add_argument(
+            "--remove_double_cuts", action="store", type=boolarg, default=False,
+            help="cut lines shared by parts placed edge to edge only once [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#remove-double-cuts)")
+        defaultgroup.add_argument(
+            "--simplify", action="store", type=float, default=0.0,
+            help="max deviation (in mm) when replacing many short lines by fewer lines, arcs and curves (zero to disable) [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#simplify)")
+        defaultgroup.add_argument(
+            "--processes", action="store", type=int, default=1,
+            help="number of processes writing the files of big drawings (0 for one per CPU) [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#processes)")
+        defaultgroup.add_argument(
+            "--svg_instances", action="store", type=boolarg, default=True,
+            help="write shapes drawn several times only once in svg files [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#svg-instances)")
+        defaultgroup.add_argument(
+            "--svg_compact", action="store", type=boolarg, default=False,
+            help="write svg files with relative coordinates and one layer per color [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#svg-compact)")
+        defaultgroup.add_argument(
+            "--svg_precision", action="store", type=int, default=3,
+            help="digits after the decimal point of the coordinates in svg files [\U0001F6C8](https://florianfesti.github.io/boxes/html/usermanual.html#svg-compact)")
 
     @contextmanager
     def saved_context(self):
@@ -363,6 +432,69 @@ class Boxes:
         finally:
             cr.restore()
 
+    def _drawing_state(self):
+        """Objects that can change what gets drawn - for comparing by
+        identity. Contains the attributes of the generator and the
+        contents of lists and dicts among them, the edges and the
+        attributes and values of all settings objects among these.
+        """
+        state = list(self.__dict__.values())
+        for value in state[:]:
+            if type(value) is list:
+                state.extend(value)
+            elif type(value) is dict:
+                state.extend(value.values())
+        # attributes of each edge and settings object once
+        attrs: dict[int, dict] = {}
+
+        def add(obj):
+            d = getattr(obj, "__dict__", None)
+            if d is None or id(obj) in attrs:
+                return None
+            attrs[id(obj)] = d
+            if type(d.get("values")) is dict:
+                attrs[id(d["values"])] = d["values"]
+            return d
+
+        for edge in self.edges.values():
+            d = add(edge)
+            if d is not None and d.get("settings") is not None:
+                add(d["settings"])
+        for value in state:
+            if isinstance(value, edges.Settings):
+                add(value)
+        for d in attrs.values():
+            state.extend(d.values())
+        return state
+
+    def _record(self, func, args, kw):
+        """Call func(*args, **kw) recording the context calls made
+
+        Returns the result of func and the calls for Context.replay() -
+        None if replaying them would not be the same as calling func
+        again: The calls depend on what was drawn before or func changed
+        the generator, its edges or their settings (see _drawing_state())
+        or used random numbers.
+
+        Changes that _drawing_state() doesn't see are not noticed: objects
+        changed in place deeper down (e.g. lists within lists or
+        attributes of other helper objects) and state kept in closures or
+        globals. Generators drawing parts that depend on these need to
+        set replay_parts to False.
+        """
+        state = self._drawing_state()
+        random_state = random.getstate()
+        start = self.ctx.start_recording()
+        try:
+            result = func(*args, **kw)
+        finally:
+            calls = self.ctx.stop_recording(start)
+        after = self._drawing_state()
+        if (random.getstate() != random_state or len(state) != len(after)
+                or not all(map(operator.is_, state, after))):
+            calls = None
+        return result, calls
+
     def set_source_color(self, color):
         """
         Sets the color of the pen.
@@ -400,6 +532,7 @@ class Boxes:
 
         self.spacing = 2 * self.burn + 0.5 * self.thickness
         self.set_font("sans-serif")
+        self._edge_memo = {}  # see edges.memoized()
         self._buildObjects()
         if self.reference and self.format != 'svg_Ponoko':
             self.move(self.reference, 10, "up", before=True)
@@ -559,10 +692,13 @@ class Boxes:
             if (value != default):
                 self.non_default_args[key] = value
 
+        # Geometry is rendered for the first format and copied for the others
+        self.output_formats = getattr(self, "format", "svg").split(",")
+        self.format = self.output_formats[0]
+
         # Change file ending to format if not given explicitly
-        format = getattr(self, "format", "svg")
         if getattr(self, 'output', None) == 'box.svg':
-            self.output = 'box.' + format.split("_")[0]
+            self.output = 'box.' + self.format.split("_")[0]
 
         self.metadata["cli_short"] = "boxes " + self.__class__.__name__ + " " + " ".join(cliquote(arg) for arg in args if (arg.split("=")[0][2:] in self.non_default_args))
 
@@ -734,11 +870,38 @@ class Boxes:
         else:
             return param
 
-    def close(self):
+    def outputFiles(self, formats=None):
+        """Return the (format, filename) pairs written by .close()
+
+        .format is written to .output. Other formats replace the file
+        ending of .output (or append to it).
+
+        :param formats:  (Default value = None) list of formats, None for the ones given by --format
+        """
+        if formats is None:
+            formats = [self.format] + self.output_formats
+        base, ext = os.path.splitext(self.output)
+        if ext != "." + self.format.split("_")[0]:
+            base = self.output
+        result = []
+        for fmt in formats:
+            if fmt in (f for f, _ in result):
+                continue
+            if fmt == self.format:
+                result.append((fmt, self.output))
+            else:
+                result.append((fmt, base + "." + fmt.split("_")[0]))
+        return result
+
+    def close(self, formats=None):
         """Finish rendering
 
-        Flush canvas to disk and convert output to requested format if needed.
-        Call after .render()"""
+        Flush canvas to disk and convert output to requested formats if needed.
+        The drawing is rendered once and then written in all formats.
+        Call after .render()
+
+        :param formats:  (Default value = None) list of formats, None for the ones given by --format
+        """
         if self.ctx is None:
             return
 
@@ -748,9 +911,24 @@ class Boxes:
         self.surface.set_metadata(self.metadata)
 
         self.surface.flush()
-        self.surface.finish(self.inner_corners)
+        if self.remove_double_cuts:
+            toolpath.remove_double_cuts(self.surface)
+        if self.join_paths:
+            toolpath.join_paths(self.surface)
+        if self.simplify:
+            toolpath.simplify(self.surface, self.simplify)
+        if self.optimize_travel:
+            toolpath.optimize_travel(self.surface)
+        outputs = self.outputFiles(formats)
+        self.formats.processes = self.processes or None
+        for fmt, _ in outputs:
+            self.formats.setOptions(fmt, processes=self.processes or None)
+        self.formats.setOptions("svg", instances=self.svg_instances,
+                                compact=self.svg_compact,
+                                precision=self.svg_precision)
+        self.formats.write(self.surface, outputs,
+                           self.inner_corners, self.metadata)
 
-        self.formats.convert(self.output, self.format, self.metadata)
         if self.inkscapefile:
             try:
                 out = sys.stdout.buffer
@@ -804,13 +982,6 @@ class Boxes:
             self.corner(lang/2., radius)
             return
 
-        if ((radius > 0.5* self.burn and abs(degrees) > 36) or
-            (abs(degrees) > 100)):
-            steps = int(abs(degrees)/ 36.) + 1
-            for i in range(steps):
-                self.corner(float(degrees)/steps, radius)
-            return
-
         if degrees > 0:
             self.ctx.arc(0, radius + self.burn, radius + self.burn,
                          -0.5 * math.pi, rad - 0.5 * math.pi)
@@ -888,6 +1059,12 @@ class Boxes:
         lengths may be a tuple (length, #tabs)
         angles may be tuple (angle, radius)
         """
+        if type(self).edge is Boxes.edge and type(self).corner is Boxes.corner:
+            # all at once - see polyline_segment()
+            segment = polyline_segment(args, self.burn, self.tabs)
+            if segment is not None:
+                self.ctx.draw_segment(segment)
+            return
         for i, arg in enumerate(args):
             if i % 2:
                 if isinstance(arg, tuple):
@@ -1242,12 +1419,7 @@ class Boxes:
         """
         r += self.burn
         self.moveTo(x + r, y)
-        a = 0
-        n = 10
-        da = 2 * math.pi / n
-        for i in range(n):
-            self.ctx.arc(-r, 0, r, a, a+da)
-            a += da
+        self.ctx.arc(-r, 0, r, 0, 2 * math.pi)
         self.ctx.stroke()
 
     @restore
@@ -2929,16 +3101,29 @@ class Boxes:
             move = ""
         move = move.split()
 
+        # all parts are the same: draw the first one and replay its
+        # context calls for the others (see _record()) - if there are
+        # enough of them to make up for recording
+        recording = None if self.replay_parts and n > 2 else False
+
+        def draw(where):
+            nonlocal recording
+            kw["move"] = where
+            if where != "right" or recording is False:
+                part(*l, **kw)
+            elif recording is None:
+                recording = self._record(part, l, kw)[1] or False
+            else:
+                self.ctx.replay(recording)
+
         #move down / left before
         for m in move:
             if m == "left":
-                kw["move"] = "left only"
                 for i in range(width):
-                    part(*l, **kw)
+                    draw("left only")
             if m == "down":
-                kw["move"] = "down only"
                 for i in range(rows):
-                    part(*l, **kw)
+                    draw("down only")
         # draw matrix
         for i in range(rows):
             with self.saved_context():
@@ -2947,22 +3132,18 @@ class Boxes:
                         break
                     if width*i+j >= n:
                         break
-                    kw["move"] = "right"
-                    part(*l, **kw)
-            kw["move"] = "up only"
-            part(*l, **kw)
+                    draw("right")
+            draw("up only")
 
         # Move back down
         if "up" not in move:
-            kw["move"] = "down only"
             for i in range(rows):
-                part(*l, **kw)
+                draw("down only")
 
         # Move right
         if "right" in move:
-            kw["move"] = "right only"
             for i in range(width):
-                part(*l, **kw)
+                draw("right only")
 
     def mirrorX(self, f, offset=0.0):
         """Wrap a function to draw mirrored at the y axis
@@ -1,7 +1,21 @@
 from __future__ import annotations
 
+import ast
+import copy
 import datetime
+import functools
+import itertools
+import json
 import math
+import mmap
+import operator
+import os
+import struct
+import sys
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
 from typing import Any
 from xml.etree import ElementTree as ET
 
@@ -9,26 +23,108 @@ from affine import Affine
 
 from boxes.extents import Extents
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
 EPS = 1e-4
 PADDING = 10
 
 RANDOMIZE_COLORS = False  # enable to ease check for continuity of paths
 
+# Opcodes of the path commands and the number of coordinates stored for each
+MOVE, LINE, CURVE, TEXT, ARC = b"MLCTA"
+NARGS = {MOVE: 2, LINE: 2, CURVE: 6, TEXT: 2, ARC: 6}
+
+
+# names of the colors in boxes.Color by 4*r + 2*g + b
+COLOR_NAMES = ["OUTER_CUT", "INNER_CUT", "ETCHING", "ETCHING_DEEP",
+               "ANNOTATIONS", "MAGENTA", "YELLOW", "WHITE"]
+
+
+def color_name(rgb):
+    r, g, b = (int(round(c)) for c in rgb)
+    return COLOR_NAMES[4*r + 2*g + b]
+
 
 def points_equal(x1, y1, x2, y2):
     return abs(x1 - x2) < EPS and abs(y1 - y2) < EPS
 
 
+def transform_coords(buffers, m):
+    """Apply Affine m to all points in the coordinate arrays in place
+
+    Uses one batched NumPy operation over all buffers if available.
+    """
+    a, b, c, d, e, f = m[:6]
+    if np is not None:
+        views = [np.frombuffer(buf) for buf in buffers if len(buf)]
+        if not views:
+            return
+        pts = np.concatenate(views)
+        xs, ys = pts[0::2], pts[1::2]
+        # same operations in the same order as Affine.__mul__
+        pts[0::2], pts[1::2] = xs * a + ys * b + c, xs * d + ys * e + f
+        pos = 0
+        for v in views:
+            v[:] = pts[pos:pos+len(v)]
+            pos += len(v)
+        return
+    for buf in buffers:
+        xs, ys = buf[0::2], buf[1::2]
+        buf[0::2] = array("d", [x * a + y * b + c for x, y in zip(xs, ys)])
+        buf[1::2] = array("d", [x * d + y * e + f for x, y in zip(xs, ys)])
+
+
+def shape_coords(coords, digits=3):
+    """Return coords relative to their first point rounded to digits after
+    the decimal point as bytes. Equal for paths that only differ in
+    position.
+    """
+    x, y = coords[0], coords[1]
+    if np is not None:
+        pts = np.frombuffer(coords).reshape(-1, 2) - (x, y)
+        return (np.round(pts, digits) + 0.0).tobytes()  # + 0.0 turns -0.0 into 0.0
+    return array("d", [round(c - o, digits) + 0.0 for c, o in
+                       zip(coords, (x, y) * (len(coords) // 2))]).tobytes()
+
+
+# cos and sin of rotations by right angles as used by affine.Affine.rotation()
+RIGHT_ANGLES = {
+    0.0: (1.0, 0.0),
+    90.0: (0.0, 1.0),
+    180.0: (-1.0, 0),
+    270.0: (0, -1.0),
+}
+
+
+def params_key(params):
+    """Hashable version of stroke params"""
+    return tuple((k, tuple(v) if isinstance(v, list) else v)
+                 for k, v in sorted(params.items()))
+
+
 def pdiff(p1, p2):
     x1, y1 = p1
     x2, y2 = p2
     return (x1 - x2, y1 - y2)
 
 
+def _call_surface(surface, name, part, job):
+    """Call a method serializing a part in a worker process"""
+    return getattr(surface, name)(part, *job)
+
+
 class Surface:
 
     scale = 1.0
     invert_y = False
+    # number of worker processes writing the parts of big drawings - None
+    # for one per CPU, 1 to write everything in this process
+    processes = 1
+    # minimal number of path commands to use worker processes for
+    parallel_threshold = 50000
 
     def __init__(self, fname) -> None:
         self._fname = fname
@@ -45,6 +141,31 @@ class Surface:
     def finish(self):
         pass
 
+    def _map_parts(self, name, jobs):
+        """Yield the results of the method called name for the (i, *args)
+        in jobs in order. It is called with the ith part and (i, *args).
+
+        Big drawings are serialized in a pool of worker processes
+        if processes is not 1. They get pickled copies of the parts.
+        """
+        workers = self.processes or os.cpu_count() or 1
+        size = sum(len(path.ops) for part in self.parts
+                   for path in part.pathes)
+        if workers == 1 or size < self.parallel_threshold:
+            method = getattr(self, name)
+            for job in jobs:
+                yield method(self.parts[job[0]], *job)
+            return
+        worker = copy.copy(self)  # without the parts to send it cheaply
+        worker.parts = []
+        worker._p = None
+        jobs = list(jobs)
+        with ProcessPoolExecutor(workers) as pool:
+            yield from pool.map(
+                _call_surface, repeat(worker), repeat(name),
+                (self.parts[job[0]] for job in jobs), jobs,
+                chunksize=max(1, len(jobs) // (4 * workers)))
+
     def _adjust_coordinates(self):
         extents = self.extents()
         extents.xmin -= PADDING
@@ -87,6 +208,13 @@ class Surface:
             raise ValueError("Too many lines")
         self._p.append(*path)
 
+    def append_segment(self, path, m, start=None):
+        """Append the path of a Segment (see Part.append_segment())"""
+        self.count += len(path.ops) - path.ops.count(MOVE)
+        if self.count > 100000:
+            raise ValueError("Too many lines")
+        self._p.append_segment(path, m, start)
+
     def stroke(self, **params):
         return self._p.stroke(**params)
 
@@ -94,158 +222,496 @@ class Surface:
         self._p.move_to(*xy)
 
     def extents(self):
-        if not self.parts:
-            return Extents()
-        return sum([p.extents() for p in self.parts])
+        e = Extents()
+        for p in self.parts:
+            e.update(p._extents())
+        return e
+
+    def part_extents(self):
+        """Extents of the part currently drawn on"""
+        return self._p.extents()
+
+    def copy(self, cls=None, fname=None):
+        """Return a copy of the drawing on a surface of class cls
+
+        finish() changes the geometry in place. Copies allow writing the
+        same drawing to several formats.
+        """
+        s = (cls or self.__class__)(fname or self._fname)
+        s.parts = [p.copy() for p in self.parts]
+        s._p = s.parts[self.parts.index(self._p)]
+        s.count = self.count
+        if hasattr(self, "metadata"):
+            s.set_metadata(self.metadata)
+        return s
 
 
 class Part:
     def __init__(self, name) -> None:
         self.pathes: list[Any] = []
-        self.path: list[Any] = []
+        self.path = Path()
+        # index of the path end points:
+        # (cell x, cell y, params) -> positions in self.pathes
+        self._ends: dict[Any, list[int]] = {}
+        self._bbox: Extents | None = Extents()  # None if outdated
+
+    def _extents(self):
+        if self._bbox is None:
+            self._bbox = Extents()
+            for p in self.pathes:
+                self._bbox.update(p.extents())
+        return self._bbox
 
     def extents(self):
-        if not self.pathes:
-            return Extents()
-        return sum([p.extents() for p in self.pathes])
+        """Extents of all strokes of the part. Kept up to date while drawing"""
+        return self._extents().copy()
 
     def transform(self, f, m, invert_y=False):
         assert(not self.path)
+        transform_coords([p.coords for p in self.pathes], m)
         for p in self.pathes:
-            p.transform(f, m, invert_y)
+            p.transform(f, m, invert_y, coords=False)
+        self._bbox = None
+
+    def copy(self):
+        p = Part.__new__(Part)
+        p.pathes = [path.copy() for path in self.pathes]
+        p.path = self.path.copy()
+        p._ends = {k: list(v) for k, v in self._ends.items()}
+        p._bbox = None if self._bbox is None else self._bbox.copy()
+        return p
 
     def append(self, *path):
-        self.path.append(list(path))
+        self.path.append(*path)
+
+    def append_segment(self, local, m, start=None):
+        """Append the commands of local - the Path of a Segment -
+        transformed by the Affine coefficients m
+
+        start replaces the point of the first command - which is a move.
+        """
+        a, b, c, d, e, f = m
+        coords = local.coords
+        if a == 1.0 and b == 0.0 and d == 0.0 and e == 1.0:
+            coords = array("d", map(operator.add, coords, itertools.cycle((c, f))))
+        else:
+            xs, ys = coords[0::2], coords[1::2]
+            coords = array("d", coords)
+            coords[0::2] = array("d", [x * a + y * b + c for x, y in zip(xs, ys)])
+            coords[1::2] = array("d", [x * d + y * e + f for x, y in zip(xs, ys)])
+        if start is not None:
+            coords[0], coords[1] = start
+        self.move_to(coords[0], coords[1])
+        ops, i, k = local.ops, 1, 2
+        if (start is not None and len(ops) > 1 and ops[1] == LINE and
+                points_equal(*start, coords[2], coords[3])):
+            i, k = 2, 4  # see Context._line_to()
+        if len(ops) <= i:
+            return
+        path = self.path
+        n = len(path.ops)
+        if n and path.ops[-1] == MOVE:
+            n -= 1  # no longer trailing
+        path._last = len(path.coords) + local._last - k
+        path.ops += ops[i:]
+        path.coords += coords[k:]
+        if path._bbox is None:
+            return
+        if i == 1 and (b == 0.0 and d == 0.0 or a == 0.0 and e == 0.0):
+            # corners of the extents stay corners
+            if local._bbox is None:
+                local._bbox = Extents()
+                local._add_commands(0, 0)
+            bb = local._bbox
+            x1, y1 = bb.xmin * a + bb.ymin * b + c, bb.xmin * d + bb.ymin * e + f
+            x2, y2 = bb.xmax * a + bb.ymax * b + c, bb.xmax * d + bb.ymax * e + f
+            path._add_point(x1, y1)
+            path._add_point(x2, y2)
+        else:
+            path._add_commands(n, len(path.texts))
+
+    def set_pathes(self, pathes):
+        """Replace the stroked paths - e.g. by a reordered list"""
+        self.pathes = pathes
+        self._ends = {}
+        for pos in range(len(pathes)):
+            self._ends.setdefault(self._end_key(pos), []).append(pos)
+        self._bbox = None
+
+    def _end_key(self, pos):
+        p = self.pathes[pos]
+        x, y = p.last_point()
+        return (x // EPS, y // EPS, params_key(p.params))
+
+    def _find_join(self, x, y, params):
+        """Return position of the last path ending at x, y or -1"""
+        cx, cy, pk = x // EPS, y // EPS, params_key(params)
+        found = -1
+        # points closer than EPS are at most one cell apart
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for pos in self._ends.get((cx + dx, cy + dy, pk), ()):
+                    p = self.pathes[pos]
+                    if (pos > found and points_equal(x, y, *p.last_point())
+                        and p.params == params):
+                        found = pos
+        return found
 
     def stroke(self, **params):
         if len(self.path) == 0:
             return
         # search for path ending at new start coordinates to append this path to
-        xy0 = self.path[0][1:3]
-        if (not points_equal(*xy0, *self.path[-1][1:3]) and
-            not self.path[0][0] == "T"):
-            for p in reversed(self.pathes):
-                xy1 = p.path[-1][1:3]
-                if points_equal(*xy0, *xy1) and p.params == params:
-                    p.path.extend(self.path[1:])
-                    self.path = []
-                    return p
-        p = Path(self.path, params)
+        xy0 = self.path.coords[0:2]
+        if (not points_equal(*xy0, *self.path.last_point()) and
+            not self.path.ops[0] == TEXT):
+            pos = self._find_join(*xy0, params)
+            if pos >= 0:
+                p = self.pathes[pos]
+                self._ends[self._end_key(pos)].remove(pos)
+                p.extend(self.path, 1)
+                self._ends.setdefault(self._end_key(pos), []).append(pos)
+                if self._bbox is not None:
+                    self._bbox.update(p.extents())
+                self.path = Path()
+                return p
+        p = self.path
+        p.params = params
         self.pathes.append(p)
-        self.path = []
+        pos = len(self.pathes) - 1
+        self._ends.setdefault(self._end_key(pos), []).append(pos)
+        if self._bbox is not None:
+            self._bbox.update(p.extents())
+        self.path = Path()
         return p
 
     def move_to(self, *xy):
         if len(self.path) == 0:
-            self.path.append(["M", *xy])
-        elif self.path[-1][0] == "M":
-            self.path[-1] = ["M", *xy]
+            self.path.append(MOVE, *xy)
+        elif self.path.ops[-1] == MOVE:
+            self.path.set_last_point(*xy)
         else:
-            xy0 = self.path[-1][1:3]
+            xy0 = self.path.last_point()
             if not points_equal(*xy0, *xy):
-                self.path.append(["M", *xy])
+                self.path.append(MOVE, *xy)
 
 
 class Path:
-    def __init__(self, path, params) -> None:
-        self.path = path
+    """Path with its commands stored in flat arrays
+
+    ops holds one opcode per command, coords the points of all commands
+    back to back (destination first, then control points) and texts the
+    (matrix, text, params) tuple of each TEXT command.
+
+    An ARC starts at the previous point and stores its end point, its
+    center and the point at a quarter of its sweep (see arc_sweep()).
+    As all of them are points they stay correct in every transformation
+    that keeps circles circles - including mirroring.
+
+    The extents are updated while appending. They leave out a trailing
+    MOVE as that may still be replaced.
+    """
+
+    __slots__ = "ops coords texts params _last _bbox".split()
+
+    def __init__(self, params=None) -> None:
+        self.ops = bytearray()
+        self.coords = array("d")
+        self.texts: list[Any] = []
         self.params = params
+        self._last = 0  # offset of the last command in coords
+        self._bbox: Extents | None = Extents()  # None if outdated
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self.__slots__}
+        if not isinstance(self.coords, array):
+            state["coords"] = self._own_coords()
+        return None, state
+
+    def _own_coords(self):
+        """Return a copy of coords as array
+
+        coords may be a view into a mapped .boxgeom file instead.
+        """
+        if isinstance(self.coords, array):
+            return self.coords[:]
+        return array("d", self.coords.tobytes())
 
     def __repr__(self) -> str:
-        l = len(self.path)
-        # x1,y1 = self.path[0][1:3]
+        l = len(self.ops)
         if l>0:
-            x2, y2 = self.path[-1][1:3]
+            x2, y2 = self.last_point()
             return f"Path[{l}] to ({x2:.2f},{y2:.2f})"
         return f"empty Path"
 
+    def copy(self):
+        p = Path(None if self.params is None else dict(self.params))
+        p.ops = self.ops[:]
+        p.coords = self._own_coords()
+        p.texts = self.texts[:]
+        p._last = self._last
+        p._bbox = None if self._bbox is None else self._bbox.copy()
+        return p
+
+    def _add_point(self, x, y):
+        b = self._bbox
+        if x < b.xmin: b.xmin = x
+        if x > b.xmax: b.xmax = x
+        if y < b.ymin: b.ymin = y
+        if y > b.ymax: b.ymax = y
+
+    def _add_text(self, m, text, params):
+        h = params['fs']
+        l = len(text) * h * 0.7
+        align = params.get('align', 'left')
+        start, end = {
+            'left' : (0, 1),
+            'middle' : (-0.5, 0.5),
+            'end' : (-1, 0),
+            }[align]
+        for x in (start*l, end*l):
+            for y in (0, h):
+                self._add_point(*(m * (x, y)))
+
+    def _add_arc(self, x0, y0, x, y, cx, cy, qx, qy):
+        """Add the points where the ARC touches its bounding box
+
+        The end point is left to the caller."""
+        sweep = arc_sweep(x0, y0, cx, cy, qx, qy)
+        r = math.hypot(x - cx, y - cy)
+        a0 = math.atan2(y0 - cy, x0 - cx)
+        for i, (dx, dy) in enumerate(((r, 0), (0, r), (-r, 0), (0, -r))):
+            da = (i * 0.5 * math.pi - a0) % (2 * math.pi)
+            if sweep < 0:
+                da = (2 * math.pi - da) % (2 * math.pi)
+            if da <= abs(sweep):
+                self._add_point(cx + dx, cy + dy)
+
+    def _add_commands(self, n, t):
+        """Add all commands from number n (with text number t) to extents"""
+        ops, coords = self.ops, self.coords
+        k = self._last
+        for i in range(len(ops) - 1, n - 1, -1):
+            if i < len(ops) - 1 or ops[i] != MOVE:
+                self._add_point(coords[k], coords[k+1])
+            if i > 0:
+                k0 = k - NARGS[ops[i-1]]
+                if ops[i] == ARC:
+                    self._add_arc(coords[k0], coords[k0+1], *coords[k:k+6])
+                if i > n:
+                    k = k0
+        for text in self.texts[t:]:
+            self._add_text(*text)
+
+    def append(self, op, x, y, *args):
+        if self._bbox is not None and self.ops:
+            if self.ops[-1] == MOVE:
+                self._add_point(*self.last_point())
+            if op == ARC:
+                self._add_arc(*self.last_point(), x, y, *args)
+        self._last = len(self.coords)
+        self.ops.append(op)
+        self.coords.append(x)
+        self.coords.append(y)
+        if op == TEXT:
+            self.texts.append(args)
+        elif args:
+            self.coords.extend(args)
+        if self._bbox is not None and op != MOVE:
+            self._add_point(x, y)
+            if op == TEXT:
+                self._add_text(*args)
+
+    def extend(self, path, start=0):
+        """Append the commands of path beginning with command number start"""
+        if len(path.ops) <= start:
+            return
+        k = sum(NARGS[op] for op in path.ops[:start])
+        t = path.ops.count(TEXT, 0, start)
+        n = len(self.ops)
+        if n and self.ops[-1] == MOVE:
+            n -= 1  # no longer trailing
+        self._last = len(self.coords) + path._last - k
+        self.ops += path.ops[start:]
+        self.coords += path.coords[k:]
+        self.texts += path.texts[t:]
+        if self._bbox is not None:
+            self._add_commands(n, len(self.texts) - len(path.texts) + t)
+
+    def last_point(self):
+        k = self._last
+        return self.coords[k], self.coords[k+1]
+
+    def set_last_point(self, x, y):
+        k = self._last
+        self.coords[k] = x
+        self.coords[k+1] = y
+
+    def offsets(self):
+        """Return offsets into coords for all commands"""
+        offs = []
+        k = 0
+        for op in self.ops:
+            offs.append(k)
+            k += NARGS[op]
+        return offs
+
     def extents(self):
-        e = Extents()
-        for p in self.path:
-            e.add(*p[1:3])
-            if p[0] == 'T':
-                m, text, params = p[3:]
-                h = params['fs']
-                l = len(text) * h * 0.7
-                align = params.get('align', 'left')
-                start, end = {
-                    'left' : (0, 1),
-                    'middle' : (-0.5, 0.5),
-                    'end' : (-1, 0),
-                    }[align]
-                for x in (start*l, end*l):
-                    for y in (0, h):
-                        x_, y_ = m * (x, y)
-                        e.add(x_, y_)
+        if self._bbox is None:
+            self._bbox = Extents()
+            if self.ops:
+                self._add_commands(0, 0)
+        e = self._bbox.copy()
+        if self.ops and self.ops[-1] == MOVE:
+            e.add(*self.last_point())
         return e
 
-    def transform(self, f, m, invert_y=False):
+    def transform(self, f, m, invert_y=False, coords=True):
+        """Transform the path by Affine m scaling line width by f
+
+        :param coords: also transform coords. Part.transform() does this
+                       for all its paths at once
+        """
         self.params["lw"] *= f
-        for c in self.path:
-            C = c[0]
-            c[1], c[2] = m * (c[1], c[2])
-            if C == 'C':
-                c[3], c[4] = m * (c[3], c[4])
-                c[5], c[6] = m * (c[5], c[6])
-            if C == "T":
-                c[3] = m * c[3]
-                if invert_y:
-                    c[3] *= Affine.scale(1, -1)
+        if coords:
+            # all commands store whole points so the coordinates can be
+            # transformed without looking at the opcodes
+            transform_coords([self.coords], m)
+        for i, (tm, text, params) in enumerate(self.texts):
+            tm = m * tm
+            if invert_y:
+                tm *= Affine.scale(1, -1)
+            self.texts[i] = (tm, text, params)
+        self._bbox = None
+
+    def is_stroke(self):
+        """True for a single line without gaps and texts"""
+        return (len(self.ops) > 1 and self.ops[0] == MOVE and
+                self.ops.count(MOVE) == 1 and not self.texts)
+
+    def reversed(self):
+        """Return the path drawn backwards. Only for strokes (see is_stroke())"""
+        ops, coords = self.ops, self.coords
+        offs = self.offsets()
+        path = Path(self.params)
+        path.append(MOVE, *self.last_point())
+        for i in range(len(ops) - 1, 0, -1):
+            op, k, k0 = ops[i], offs[i], offs[i-1]
+            x0, y0 = coords[k0], coords[k0+1]
+            if op == LINE:
+                path.append(LINE, x0, y0)
+            elif op == CURVE:
+                path.append(CURVE, x0, y0, *coords[k+4:k+6], *coords[k+2:k+4])
+            else:  # ARC
+                x, y, cx, cy, qx, qy = coords[k:k+6]
+                r = math.hypot(x - cx, y - cy)
+                a = (math.atan2(y - cy, x - cx) -
+                     0.25 * arc_sweep(x0, y0, cx, cy, qx, qy))
+                path.append(ARC, x0, y0, cx, cy,
+                            cx + r * math.cos(a), cy + r * math.sin(a))
+        return path
+
+    def rotated(self, n):
+        """Return the closed stroke starting at the end of command n"""
+        ops, coords = self.ops, self.coords
+        offs = self.offsets()
+        path = Path(self.params)
+        path.append(MOVE, coords[offs[n]], coords[offs[n]+1])
+        for i in list(range(n + 1, len(ops))) + list(range(1, n + 1)):
+            op, k = ops[i], offs[i]
+            path.append(op, *coords[k:k+NARGS[op]])
+        return path
 
     def faster_edges(self, inner_corners):
         if inner_corners == "backarc":
             return
 
-        for (i, p) in enumerate(self.path):
-            if p[0] == "C" and i > 1 and i < len(self.path) - 1:
-                if self.path[i - 1][0] == "L" and self.path[i + 1][0] == "L":
-                    p11 = self.path[i - 2][1:3]
-                    p12 = self.path[i - 1][1:3]
-                    p21 = p[1:3]
-                    p22 = self.path[i + 1][1:3]
-                    if (((p12[0]-p21[0])**2 + (p12[1]-p21[1])**2) >
-                        self.params["lw"]**2):
-                        continue
-                    lines_intersect, x, y = line_intersection((p11, p12), (p21, p22))
-                    if lines_intersect:
-                        self.path[i - 1] = ("L", x, y)
-                        if inner_corners == "loop":
-                            self.path[i] = ("C", x, y, *p12, *p21)
-                        else:
-                            self.path[i] =  ("L", x, y)
+        ops, coords = self.ops, self.coords
+        offs = self.offsets()
+        # commands rewritten below. They are only considered duplicates of
+        # other rewritten commands
+        changed = bytearray(len(ops))
+        for i in range(2, len(ops) - 1):
+            if ops[i] in (CURVE, ARC) and ops[i - 1] == LINE and ops[i + 1] == LINE:
+                k11, k12, k21, k22 = offs[i-2:i+2]
+                p11 = coords[k11], coords[k11+1]
+                p12 = coords[k12], coords[k12+1]
+                p21 = coords[k21], coords[k21+1]
+                p22 = coords[k22], coords[k22+1]
+                if (((p12[0]-p21[0])**2 + (p12[1]-p21[1])**2) >
+                    self.params["lw"]**2):
+                    continue
+                lines_intersect, x, y = line_intersection((p11, p12), (p21, p22))
+                if lines_intersect:
+                    coords[k12], coords[k12+1] = x, y
+                    changed[i - 1] = changed[i] = 1
+                    if inner_corners == "loop":
+                        ops[i] = CURVE
+                        coords[k21:k21+6] = array("d", (x, y, *p12, *p21))
+                    else:
+                        ops[i] = LINE
+                        coords[k21], coords[k21+1] = x, y
         # filter duplicates
-        if len(self.path) > 1: # no need to find duplicates if only one element in path
-            self.path = [p for n, p in enumerate(self.path) if p != self.path[n-1]]
+        if len(ops) > 1: # no need to find duplicates if only one element in path
+            tix = []
+            t = 0
+            for op in ops:
+                tix.append(t)
+                t += op == TEXT
+
+            def equal(n1, n2):
+                op = ops[n1]
+                if op != ops[n2] or changed[n1] != changed[n2]:
+                    return False
+                k1, k2 = offs[n1], offs[n2]
+                l = NARGS[op]
+                if coords[k1:k1+l] != coords[k2:k2+l]:
+                    return False
+                return op != TEXT or self.texts[tix[n1]] == self.texts[tix[n2]]
+
+            keep = [n for n in range(len(ops)) if not equal(n, n-1)]
+            if len(keep) < len(ops):
+                path = Path(self.params)
+                for n in keep:
+                    op, k = ops[n], offs[n]
+                    path.append(op, *coords[k:k+NARGS[op]],
+                                *(self.texts[tix[n]] if op == TEXT else ()))
+                self.ops, self.coords = path.ops, path.coords
+                self.texts, self._last = path.texts, path._last
+        self._bbox = None
 
 class Context:
     def __init__(self, surface, *al, **ad) -> None:
         self._renderer = self._dwg = surface
 
-        self._bounds = Extents()
         self._padding = PADDING
 
         self._stack: list[Any] = []
-        self._m = Affine.translation(0, 0)
+        # coefficients a, b, c, d, e, f of the current Affine matrix
+        self._m = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+        self._shift_only = True  # no rotation or scaling
         self._xy = (0, 0)
-        self._mxy = self._m * self._xy
+        self._mxy = self._transform(*self._xy)
         self._lw = 0
         self._rgb = (0, 0, 0)
         self._ff = "sans-serif"
         self._fs = 10
         self._last_path = None
-
-    def _update_bounds_(self, mx, my):
-        self._bounds.update(mx, my)
+        self._calls: list[Any] | None = None  # see start_recording()
+        self._recordings = 0
 
     def save(self):
         self._stack.append(
-            (self._m, self._xy, self._lw, self._rgb, self._mxy, self._last_path)
+            (self._m, self._shift_only, self._xy, self._lw, self._rgb, self._mxy, self._last_path)
         )
         self._xy = (0, 0)
 
     def restore(self):
         (
             self._m,
+            self._shift_only,
             self._xy,
             self._lw,
             self._rgb,
@@ -255,15 +721,45 @@ class Context:
 
     ## transformations
 
+    def _transform(self, x, y):
+        a, b, c, d, e, f = self._m
+        if self._shift_only:
+            return x + c, y + f
+        return x * a + y * b + c, x * d + y * e + f
+
+    def _set_matrix(self, a, b, c, d, e, f):
+        self._m = (a, b, c, d, e, f)
+        self._shift_only = a == 1.0 and b == 0.0 and d == 0.0 and e == 1.0
+
+    def get_matrix(self):
+        return Affine(*self._m)
+
+    # The matrix operations below do the same float operations as the
+    # Affine multiplication to get identical results - down to the sign
+    # of zeros that show up in text matrices
+
     def translate(self, x, y):
-        self._m *= Affine.translation(x, y)
+        a, b, c, d, e, f = self._m
+        self._m = (a + b * 0.0, a * 0.0 + b, a * x + b * y + c,
+                   d + e * 0.0, d * 0.0 + e, d * x + e * y + f)
         self._xy = (0, 0)
 
     def scale(self, sx, sy):
-        self._m *= Affine.scale(sx, sy)
+        a, b, c, d, e, f = self._m
+        self._set_matrix(a * sx + b * 0.0, a * 0.0 + b * sy, a * 0.0 + b * 0.0 + c,
+                         d * sx + e * 0.0, d * 0.0 + e * sy, d * 0.0 + e * 0.0 + f)
 
     def rotate(self, r):
-        self._m *= Affine.rotation(180 * r / math.pi)
+        # same angle calculation as affine.cos_sin_deg()
+        deg = (180 * r / math.pi) % 360.0
+        if deg in RIGHT_ANGLES:
+            ca, sa = RIGHT_ANGLES[deg]
+        else:
+            rad = math.radians(deg)
+            ca, sa = math.cos(rad), math.sin(rad)
+        a, b, c, d, e, f = self._m
+        self._set_matrix(a * ca + b * sa, a * -sa + b * ca, a * 0.0 + b * 0.0 + c,
+                         d * ca + e * sa, d * -sa + e * ca, d * 0.0 + e * 0.0 + f)
 
     def set_line_width(self, lw):
         self._lw = lw
@@ -277,16 +773,24 @@ class Context:
         self._add_move()
         x1, y1 = self._mxy
         self._xy = x, y
-        x2, y2 = self._mxy = self._m * self._xy
+        a, b, c, d, e, f = self._m
+        if self._shift_only:
+            x2, y2 = self._mxy = x + c, y + f
+        else:
+            x2, y2 = self._mxy = x * a + y * b + c, x * d + y * e + f
         if not points_equal(x1, y1, x2, y2):
-            self._dwg.append("L", x2, y2)
+            self._dwg.append(LINE, x2, y2)
 
     def _add_move(self):
         self._dwg.move_to(*self._mxy)
 
     def move_to(self, x, y):
         self._xy = (x, y)
-        self._mxy = self._m * self._xy
+        a, b, c, d, e, f = self._m
+        if self._shift_only:
+            self._mxy = (x + c, y + f)
+        else:
+            self._mxy = (x * a + y * b + c, x * d + y * e + f)
 
     def line_to(self, x, y):
         self._line_to(x, y)
@@ -294,34 +798,39 @@ class Context:
     def _arc(self, xc, yc, radius, angle1, angle2, direction):
         if abs(angle1 - angle2) < EPS or radius < EPS:
             return
-        x1, y1 = radius * math.cos(angle1) + xc, radius * math.sin(angle1) + yc
+        a, b, c, d, e, f = self._m
+        s = a * a + d * d
+        if abs(s - b * b - e * e) > EPS * s or abs(a * b + d * e) > EPS * s:
+            # the matrix turns circles into ellipses
+            self._elliptic_arc(xc, yc, radius, angle1, angle2)
+            return
+        # XXX direction seems not needed as the angles give the sweep
         x4, y4 = radius * math.cos(angle2) + xc, radius * math.sin(angle2) + yc
+        aq = angle1 + 0.25 * (angle2 - angle1)
+        xq, yq = radius * math.cos(aq) + xc, radius * math.sin(aq) + yc
 
-        # XXX direction seems not needed for small arcs
-        ax = x1 - xc
-        ay = y1 - yc
-        bx = x4 - xc
-        by = y4 - yc
-        q1 = ax * ax + ay * ay
-        q2 = q1 + ax * bx + ay * by
-        k2 = 4/3 * ((2 * q1 * q2)**0.5 - q2) / (ax * by - ay * bx)
-
-        x2 = xc + ax - k2 * ay
-        y2 = yc + ay + k2 * ax
-        x3 = xc + bx + k2 * by
-        y3 = yc + by - k2 * bx
-
-        mx1, my1 = self._m * (x1, y1)
-        mx2, my2 = self._m * (x2, y2)
-        mx3, my3 = self._m * (x3, y3)
-        mx4, my4 = self._m * (x4, y4)
-        mxc, myc = self._m * (xc, yc)
+        mxc, myc = self._transform(xc, yc)
+        mxq, myq = self._transform(xq, yq)
+        mx4, my4 = self._transform(x4, y4)
 
         self._add_move()
-        self._dwg.append("C", mx4, my4, mx2, my2, mx3, my3)
+        self._dwg.append(ARC, mx4, my4, mxc, myc, mxq, myq)
         self._xy = (x4, y4)
         self._mxy = (mx4, my4)
 
+    def _elliptic_arc(self, xc, yc, radius, angle1, angle2):
+        """Draw the arc as Béziers of up to 90° each"""
+        n = math.ceil(abs(angle2 - angle1) / (0.5 * math.pi) - EPS)
+        da = (angle2 - angle1) / n
+        for i in range(n):
+            a1 = angle1 + i * da
+            x1, y1 = radius * math.cos(a1) + xc, radius * math.sin(a1) + yc
+            x4, y4 = radius * math.cos(a1 + da) + xc, radius * math.sin(a1 + da) + yc
+            k = 4 / 3 * math.tan(da / 4) * radius
+            x2, y2 = x1 - k * math.sin(a1), y1 + k * math.cos(a1)
+            x3, y3 = x4 + k * math.sin(a1 + da), y4 - k * math.cos(a1 + da)
+            self._curve_to(x2, y2, x3, y3, x4, y4)
+
     def arc(self, xc, yc, radius, angle1, angle2):
         self._arc(xc, yc, radius, angle1, angle2, 1)
 
@@ -329,12 +838,14 @@ class Context:
         self._arc(xc, yc, radius, angle1, angle2, -1)
 
     def curve_to(self, x1, y1, x2, y2, x3, y3):
-        # mx0,my0 = self._m*self._xy
-        mx1, my1 = self._m * (x1, y1)
-        mx2, my2 = self._m * (x2, y2)
-        mx3, my3 = self._m * (x3, y3)
+        self._curve_to(x1, y1, x2, y2, x3, y3)
+
+    def _curve_to(self, x1, y1, x2, y2, x3, y3):
+        mx1, my1 = self._transform(x1, y1)
+        mx2, my2 = self._transform(x2, y2)
+        mx3, my3 = self._transform(x3, y3)
         self._add_move()
-        self._dwg.append("C", mx3, my3, mx1, my1, mx2, my2)  # destination first!
+        self._dwg.append(CURVE, mx3, my3, mx1, my1, mx2, my2)  # destination first!
         self._xy = (x3, y3)
         self._mxy = (mx3, my3)
 
@@ -358,9 +869,9 @@ class Context:
     def show_text(self, text, **args):
         params = {"ff": self._ff, "fs": self._fs, "lw": self._lw, "rgb": self._rgb}
         params.update(args)
-        mx0, my0 = self._m * self._xy
-        m = self._m
-        self._dwg.append("T", mx0, my0, m, text, params)
+        mx0, my0 = self._transform(*self._xy)
+        m = Affine(*self._m)
+        self._dwg.append(TEXT, mx0, my0, m, text, params)
 
     def text_extents(self, text):
         fs = self._fs
@@ -382,6 +893,13 @@ class Context:
     def get_current_point(self):
         return self._xy
 
+    def part_extents(self):
+        """Extents of the stroked paths of the current part
+
+        In surface coordinates. Cheap as they are updated while drawing.
+        """
+        return self._dwg.part_extents()
+
     def flush(self):
         pass
         # todo: check, if needed
@@ -391,10 +909,427 @@ class Context:
     def new_part(self):
         self._dwg.new_part()
 
+    ## recording
+
+    def start_recording(self):
+        """Start recording the calls made to the context
+
+        The context is a RecordingContext until the recording stops.
+        Returns the start to pass to stop_recording(). Recordings can be
+        nested.
+        """
+        if self._calls is None:
+            self._calls = []
+            self.__class__ = RecordingContext
+        self._recordings += 1
+        return len(self._calls)
+
+    def stop_recording(self, start):
+        """Stop the recording started at start
+
+        Returns the calls made since then for replay() - or None if they
+        can't be replayed somewhere else.
+        """
+        calls = self._calls[start:]
+        self._recordings -= 1
+        if not self._recordings:
+            self._calls = None
+            self.__class__ = Context
+        if not replayable(calls):
+            return None
+        return [call for call in calls if call[0] not in READERS]
+
+    def replay(self, calls):
+        """Make the calls returned by stop_recording() again
+
+        As they use the current transformation the result is the same as
+        drawing the same things again at the current position.
+        """
+        for name, args, kw in calls:
+            getattr(self, name)(*args, **kw)
+
+    def draw_segment(self, segment):
+        """Draw a Segment at the current position
+
+        Same as making the calls that drew it again but without doing all
+        the calculations.
+        """
+        if segment.path is None:
+            segment.localize()
+        a, b, c, d, e, f = m = self._m
+        s = a * a + d * d
+        if segment.arcs and (abs(s - b * b - e * e) > EPS * s or
+                             abs(a * b + d * e) > EPS * s):
+            # arcs become elliptic - see Context._arc()
+            xy = self._xy
+            self._draw_path(segment.path, segment.pending)
+            self._xy = xy
+        elif segment.path:
+            self._dwg.append_segment(segment.path, m,
+                                     self._mxy if segment.pending else None)
+        la, lb, lc, ld, le, lf = segment.matrix
+        self._set_matrix(a * la + b * ld, a * lb + b * le, a * lc + b * lf + c,
+                         d * la + e * ld, d * lb + e * le, d * lc + e * lf + f)
+        if segment.end is not None:
+            self._xy = segment.end
+        if segment.mxy is not None:
+            x, y = segment.mxy
+            self._mxy = (x * a + y * b + c, x * d + y * e + f)
+
+    def _draw_path(self, path, pending=False):
+        """Draw the commands of path with the current transformation
+
+        pending: start at the current point instead of the first move
+        """
+        ops, coords = path.ops, path.coords
+        x0 = y0 = 0.0
+        k = 0
+        for i, op in enumerate(ops):
+            x, y = coords[k], coords[k+1]
+            if op == MOVE:
+                if i or not pending:
+                    Context.move_to(self, x, y)  # not recorded
+            elif op == LINE:
+                self._line_to(x, y)
+            elif op == CURVE:
+                self._curve_to(*coords[k+2:k+6], x, y)
+            elif op == ARC:
+                cx, cy, qx, qy = coords[k+2:k+6]
+                a1 = math.atan2(y0 - cy, x0 - cx)
+                self._arc(cx, cy, math.hypot(x - cx, y - cy), a1,
+                          a1 + arc_sweep(x0, y0, cx, cy, qx, qy), 1)
+            x0, y0 = x, y
+            k += NARGS[op]
+
+
+class Segment:
+    """Lines drawn with the turtle API - in coordinates relative to the
+    position and direction at their start
+
+    See polyline_segment() and Context.draw_segment().
+    """
+
+    __slots__ = ("path", "arcs", "pending", "matrix", "end", "mxy",
+                 "_ops", "_coords", "_m")
+
+    def __init__(self, ops, coords, pending, matrix, end=None, mxy=None, m=None) -> None:
+        """
+        :param ops, coords: the commands of the path
+        :param pending: the path starts at the current point - and not at its first move
+        :param matrix: the transformation at the end
+        :param end: the current point at the end - None if unchanged
+        :param mxy: where the next line starts - None if unchanged
+        :param m: the transformation all coordinates were transformed with (see localize())
+        """
+        self.arcs = ARC in ops
+        self.pending = pending
+        self.matrix = matrix
+        self.end = end
+        self.mxy = mxy
+        self._ops, self._coords, self._m = ops, coords, m
+        self.path = None
+
+    def localize(self):
+        """Set up path - undoing the transformation m
+
+        Only done when the Segment is drawn for the first time.
+        """
+        path = Path()
+        path.ops, path.coords = self._ops, self._coords
+        if path.ops:
+            path._last = len(path.coords) - NARGS[path.ops[-1]]
+        path._bbox = None  # only calculated when needed
+        self.path = path
+        m, self._ops, self._coords, self._m = self._m, None, None, None
+        if m is None:
+            return
+        a, b, c, d, e, f = m
+        det = a * e - b * d
+        ia, ib, id, ie = e / det, -b / det, -d / det, a / det
+        ic, if_ = -(ia * c + ib * f), -(id * c + ie * f)
+
+        coords = path.coords
+        xs, ys = coords[0::2], coords[1::2]
+        coords[0::2] = array("d", [x * ia + y * ib + ic for x, y in zip(xs, ys)])
+        coords[1::2] = array("d", [x * id + y * ie + if_ for x, y in zip(xs, ys)])
+        a, b, c, d, e, f = self.matrix
+        self.matrix = (ia * a + ib * d, ia * b + ib * e, ia * c + ib * f + ic,
+                       id * a + ie * d, id * b + ie * e, id * c + ie * f + if_)
+        if self.mxy is not None:
+            x, y = self.mxy
+            self.mxy = (x * ia + y * ib + ic, x * id + y * ie + if_)
+
+
+def polyline_segment(args, burn=0.0, tabs=0.0):
+    """Return the lines Boxes.polyline() draws as Segment
+
+    Does the same as the calls to Boxes.edge() and Boxes.corner() -
+    including the burn correction and the tabs - but in one go with
+    plain floats instead of going through the Context for every
+    element. None if there is nothing to draw.
+    """
+    if not args:
+        return None
+    ops = bytearray()
+    coords: list[float] = []
+    # transformation relative to the start
+    a, b, c, d, e, f = 1.0, 0.0, 0.0, 0.0, 1.0, 0.0
+    phi = 0.0  # rotation of the transformation
+    x = y = 0.0  # current point
+    mx = my = 0.0  # current point transformed
+    lx = ly = 0.0  # end of the path
+    # points for the extents - see Path.append() and Path._add_arc()
+    xs: list[float] = []
+    ys: list[float] = []
+
+    # same as the Context methods
+
+    def add_move():
+        nonlocal lx, ly
+        if not ops:
+            ops.append(MOVE)
+            coords.extend((mx, my))
+        elif ops[-1] == MOVE:
+            coords[-2:] = (mx, my)
+        elif not points_equal(lx, ly, mx, my):
+            ops.append(MOVE)
+            coords.extend((mx, my))
+        lx, ly = mx, my
+
+    def move_to(x1, y1):
+        nonlocal x, y, mx, my
+        x, y = x1, y1
+        mx, my = x1 * a + y1 * b + c, x1 * d + y1 * e + f
+
+    def line_to(x1, y1):
+        nonlocal lx, ly
+        add_move()
+        x0, y0 = mx, my
+        move_to(x1, y1)
+        if not points_equal(x0, y0, mx, my):
+            if ops[-1] == MOVE:
+                xs.append(lx)
+                ys.append(ly)
+            xs.append(mx)
+            ys.append(my)
+            ops.append(LINE)
+            coords.extend((mx, my))
+            lx, ly = mx, my
+
+    def arc(xc, yc, radius, angle1, angle2):
+        nonlocal x, y, mx, my, lx, ly
+        if abs(angle1 - angle2) < EPS or radius < EPS:
+            return
+        x4, y4 = radius * math.cos(angle2) + xc, radius * math.sin(angle2) + yc
+        aq = angle1 + 0.25 * (angle2 - angle1)
+        xq, yq = radius * math.cos(aq) + xc, radius * math.sin(aq) + yc
+        add_move()
+        if ops[-1] == MOVE:
+            xs.append(lx)
+            ys.append(ly)
+        x, y = x4, y4
+        mx, my = lx, ly = x4 * a + y4 * b + c, x4 * d + y4 * e + f
+        mxc, myc = xc * a + yc * b + c, xc * d + yc * e + f
+        ops.append(ARC)
+        coords.extend((mx, my, mxc, myc, xq * a + yq * b + c, xq * d + yq * e + f))
+        xs.append(mx)
+        ys.append(my)
+        sweep = angle2 - angle1
+        a0 = angle1 + phi
+        for i, (dx, dy) in enumerate(((radius, 0), (0, radius), (-radius, 0), (0, -radius))):
+            da = (i * 0.5 * math.pi - a0) % (2 * math.pi)
+            if sweep < 0:
+                da = (2 * math.pi - da) % (2 * math.pi)
+            if da <= abs(sweep):
+                xs.append(mxc + dx)
+                ys.append(myc + dy)
+
+    def translate(x1, y1):
+        nonlocal x, y, c, f
+        c, f = a * x1 + b * y1 + c, d * x1 + e * y1 + f
+        x = y = 0.0
+
+    def rotate(r):
+        nonlocal a, b, d, e, phi
+        phi += r
+        deg = (180 * r / math.pi) % 360.0
+        if deg in RIGHT_ANGLES:
+            ca, sa = RIGHT_ANGLES[deg]
+        else:
+            rad = math.radians(deg)
+            ca, sa = math.cos(rad), math.sin(rad)
+        a, b, d, e = a * ca + b * sa, a * -sa + b * ca, d * ca + e * sa, d * -sa + e * ca
+
+    # same as the turtle methods of Boxes
+
+    def move_arc(angle, r):
+        if r < 0:
+            r, angle = -r, -angle
+        rad = math.radians(angle)
+        move_to(0, 0)
+        if angle > 0:
+            translate(r * math.sin(rad), r * (1 - math.cos(rad)))
+        else:
+            translate(r * math.sin(-rad), -r * (1 - math.cos(rad)))
+        rotate(angle * math.pi / 180.0)
+        move_to(0, 0)
+
+    def corner(degrees, radius=0, n=0):
+        try:
+            degrees, radius = degrees
+        except:
+            pass
+        rad = degrees * math.pi / 180
+        if n and tabs:
+            r_ = radius + burn if degrees > 0 else radius - burn
+            tabrad = tabs / max(r_, 0.01) if degrees > 0 else -tabs / max(r_, 0.01)
+            length = abs(r_ * rad)
+            n = min(n, int(length // (n*3*tabs)))
+        if n and tabs:
+            l = (length - n * tabs) / n
+            lang = math.degrees(l / r_)
+            if degrees < 0:
+                lang = -lang
+            corner(lang / 2., radius)
+            for i in range(n):
+                move_arc(math.degrees(tabrad), r_)
+                if i < n - 1:
+                    corner(lang, radius)
+            corner(lang / 2., radius)
+            return
+        if degrees > 0:
+            arc(0, radius + burn, radius + burn, -0.5 * math.pi, rad - 0.5 * math.pi)
+        elif radius > burn:
+            arc(0, -(radius - burn), radius - burn, 0.5 * math.pi, rad + 0.5 * math.pi)
+        else:  # not rounded inner corner
+            arc(0, burn - radius, burn - radius, -0.5 * math.pi, -0.5 * math.pi + rad)
+        translate(x, y)
+        rotate(rad)
+
+    def edge(length, n=0):
+        move_to(0, 0)
+        if n and tabs:
+            if tabs > length:
+                move_to(length, 0)
+            else:
+                n = min(n, max(1, int(length // (n*3*tabs))))
+                l = (length - n * tabs) / n
+                line_to(0.5*l, 0)
+                for i in range(n-1):
+                    move_to((i+0.5)*l+tabs, 0)
+                    line_to((i+0.5)*l+tabs+l, 0)
+                if n == 1:
+                    move_to((n-0.5)*l+tabs, 0)
+                else:
+                    move_to((n-0.5)*l+2*tabs, 0)
+                line_to(length, 0)
+        else:
+            line_to(length, 0)
+        translate(x, y)
+
+    for i, arg in enumerate(args):
+        if i % 2:
+            if isinstance(arg, tuple):
+                corner(*arg)
+            else:
+                corner(arg)
+        else:
+            if isinstance(arg, tuple):
+                edge(*arg)
+            else:
+                edge(arg)
+    segment = Segment(ops, array("d", coords), False, (a, b, c, d, e, f),
+                      (0, 0), (mx, my))
+    segment.localize()
+    if xs:
+        segment.path._bbox = Extents(min(xs), min(ys), max(xs), max(ys))
+    return segment
+
+
+# Context methods recorded by RecordingContext
+RECORDED = (
+    "save", "restore", "get_matrix", "translate", "scale", "rotate",
+    "set_line_width", "set_source_rgb", "move_to", "line_to", "arc",
+    "arc_negative", "curve_to", "stroke", "fill", "set_font",
+    "set_font_size", "show_text", "text_extents", "get_current_point",
+    "part_extents", "flush", "new_part", "draw_segment")
+# Context methods that only return information about the current state
+READERS = {"get_current_point", "get_matrix", "part_extents", "text_extents"}
+# Context methods setting the current point without looking at it
+SETS_POINT = {"translate", "move_to", "line_to", "curve_to", "stroke", "fill"}
+
+
+def replayable(calls):
+    """Whether recorded Context calls can be made again at another place
+
+    Values returned by the READERS must only depend on the calls made
+    since the start of the recording. Otherwise the code making them may
+    have done something else elsewhere.
+    """
+    known = False  # current point only depends on the calls so far
+    stack = []
+    font_size = False
+    for name, args, kw in calls:
+        if name == "save":
+            stack.append(known)
+            known = True
+        elif name == "restore":
+            known = stack.pop() if stack else False
+        elif name in SETS_POINT:
+            known = True
+        elif name == "draw_segment":
+            known = known or args[0].end is not None
+        elif name in ("arc", "arc_negative"):
+            # see Context._arc(): empty arcs keep the current point
+            if (len(args) == 5 and not kw and
+                    abs(args[3] - args[4]) >= EPS and args[2] >= EPS):
+                known = True
+        elif name == "set_font_size":
+            font_size = True
+        elif name == "get_current_point":
+            if not known:
+                return False
+        elif name == "text_extents":
+            if not font_size:
+                return False
+        elif name in READERS:
+            return False
+    return True
+
+
+class RecordingContext(Context):
+    """Context recording the calls made to it (see Context.start_recording())
+
+    A Context only becomes one while recording - so drawing doesn't get
+    slower otherwise.
+    """
+
+
+def _recorded(name):
+    method = getattr(Context, name)
+
+    @functools.wraps(method)
+    def record(self, *args, **kw):
+        self._calls.append((name, args, kw))
+        return method(self, *args, **kw)
+
+    return record
+
+
+for _name in RECORDED:
+    setattr(RecordingContext, _name, _recorded(_name))
+
 
 class SVGSurface(Surface):
 
     invert_y = True
+    # write shapes drawn more than once as <use> of a single definition
+    instances = True
+    # relative path commands without trailing zeros and one layer with a
+    # CSS class per color instead of stroke attributes on every path
+    compact = False
+    # digits after the decimal point of coordinates
+    precision = 3
 
     fonts = {
         'serif' : 'TimesNewRoman, "Times New Roman", Times, Baskerville, Georgia, serif',
@@ -480,6 +1415,123 @@ Creation date: {date}
         m.tail = '\n'
         root.insert(0, m)
 
+    def _number(self, v):
+        """Format the coordinate v - without trailing zeros if compact"""
+        t = f"{v:.{self.precision}f}"
+        if self.compact and "." in t:
+            t = t.rstrip("0").rstrip(".")
+            if t == "-0":
+                t = "0"
+        return t
+
+    def _path_data(self, g, path, ox=0.0, oy=0.0):
+        """Return the path data of path relative to ox, oy
+
+        Texts are added to g as text elements.
+        """
+        p = []
+        n = self._number
+        compact = self.compact
+        x, y = 0, 0
+        # point the relative commands refer to - rounded like the output
+        px = py = sx = sy = 0.0
+        start = None
+        last = None
+        coords = path.coords
+        texts = iter(path.texts)
+        k = 0
+
+        def cmd(c, *points, args=()):
+            """Add command c with args and points given as absolute x, y"""
+            nonlocal px, py
+            nums = list(args)
+            if compact:
+                for i, v in enumerate(points):
+                    v = round(v, self.precision)
+                    nums.append(n(v - (px if i % 2 == 0 else py)))
+                p.append(c.lower() + " ".join(nums))
+            else:
+                nums.extend(n(v) for v in points)
+                p.append(" ".join([c] + nums))
+            px = round(points[-2], self.precision)
+            py = round(points[-1], self.precision)
+
+        for C in path.ops:
+            x0, y0 = x, y
+            x, y = coords[k] - ox, coords[k+1] - oy
+            if C == MOVE:
+                if start is not None and points_equal(
+                        coords[start], coords[start+1],
+                        coords[last], coords[last+1]):
+                    p.append("z" if compact else "Z")
+                    px, py = sx, sy
+                start = k
+                cmd("M", x, y)
+                sx, sy = px, py
+            elif C == LINE:
+                if abs(x - x0) < EPS:
+                    if compact:
+                        p.append("v" + n(round(y, self.precision) - py))
+                        py = round(y, self.precision)
+                    else:
+                        p.append(f"V {n(y)}")
+                elif abs(y - y0) < EPS:
+                    if compact:
+                        p.append("h" + n(round(x, self.precision) - px))
+                        px = round(x, self.precision)
+                    else:
+                        p.append(f"H {n(x)}")
+                else:
+                    cmd("L", x, y)
+            elif C == CURVE:
+                x1, y1, x2, y2 = coords[k+2:k+6]
+                cmd("C", x1 - ox, y1 - oy, x2 - ox, y2 - oy, x, y)
+            elif C == ARC:
+                cx, cy, qx, qy = coords[k+2:k+6]
+                cx, cy, qx, qy = cx - ox, cy - oy, qx - ox, qy - oy
+                sweep = arc_sweep(x0, y0, cx, cy, qx, qy)
+                r = math.hypot(x - cx, y - cy)
+                rs = n(r)
+                flag = str(int(sweep > 0))
+                if abs(sweep) > 1.5 * math.pi:
+                    # end point must differ from start point
+                    a = math.atan2(y0 - cy, x0 - cx) + 0.5 * sweep
+                    cmd("A", cx + r * math.cos(a), cy + r * math.sin(a),
+                        args=(rs, rs, "0", "0", flag))
+                    sweep *= 0.5
+                large = str(int(abs(sweep) > math.pi))
+                cmd("A", x, y, args=(rs, rs, "0", large, flag))
+            elif C == TEXT:
+                m, text, params = next(texts)
+                m = m * Affine.translation(0, -params['fs'])
+                tm = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
+                font, bold, italic = params['ff']
+                fontweight = ("normal", "bold")[bool(bold)]
+                fontstyle = ("normal", "italic")[bool(italic)]
+
+                style = f"font-family: {font} ; font-weight: {fontweight}; font-style: {fontstyle}; fill: {rgb_to_svg_color(*params['rgb'])}"
+                t = ET.SubElement(g, "text",
+                                  #x=f"{x:.3f}", y=f"{y:.3f}",
+                                  transform=f"matrix( {tm} )",
+                                  style=style)
+                t.text = text
+                t.set("font-size", f"{params['fs']}px")
+                t.set("text-anchor", params.get('align', 'left'))
+                t.set("dominant-baseline", 'hanging')
+            else:
+                print("Unknown", chr(C))
+
+            last = k
+            k += NARGS[C]
+
+        if start is not None and start != last and \
+           points_equal(coords[start], coords[start+1],
+                        coords[last], coords[last+1]):
+            p.append("z" if compact else "Z")
+        if p and p[-1][0] in "Mm":
+            p.pop()
+        return ("" if compact else " ").join(p)
+
     def finish(self, inner_corners="loop"):
         extents = self._adjust_coordinates()
         w = extents.width * self.scale
@@ -502,82 +1554,169 @@ Creation date: {date}
         for name, value in nsmap.items():
             svg.set(f"xmlns:{name}", value)
         svg.text = "\n"
-        tree = ET.ElementTree(svg)
 
         self._add_metadata(svg)
-        
-        for i, part in enumerate(self.parts):
-            if not part.pathes:
-                continue
-            g = ET.SubElement(svg, "g", id=f"p-{i}",
-                              style="fill:none;stroke-linecap:round;stroke-linejoin:round;")
-            g.text = "\n  "
-            g.tail = "\n"
-            for j, path in enumerate(part.pathes):
-                p = []
-                x, y = 0, 0
-                start = None
-                last = None
-                path.faster_edges(inner_corners)
-                for c in path.path:
-                    x0, y0 = x, y
-                    C, x, y = c[0:3]
-                    if C == "M":
-                        if start and points_equal(start[1], start[2],
-                                                  last[1], last[2]):
-                            p.append("Z")
-                        start = c
-                        p.append(f"M {x:.3f} {y:.3f}")
-                    elif C == "L":
-                        if abs(x - x0) < EPS:
-                            p.append(f"V {y:.3f}")
-                        elif abs(y - y0) < EPS:
-                            p.append(f"H {x:.3f}")
-                        else:
-                            p.append(f"L {x:.3f} {y:.3f}")
-                    elif C == "C":
-                        x1, y1, x2, y2 = c[3:]
-                        p.append(
-                            f"C {x1:.3f} {y1:.3f} {x2:.3f} {y2:.3f} {x:.3f} {y:.3f}"
-                        )
-                    elif C == "T":
-                        m, text, params = c[3:]
-                        m = m * Affine.translation(0, -params['fs'])
-                        tm = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
-                        font, bold, italic = params['ff']
-                        fontweight = ("normal", "bold")[bool(bold)]
-                        fontstyle = ("normal", "italic")[bool(italic)]
-
-                        style = f"font-family: {font} ; font-weight: {fontweight}; font-style: {fontstyle}; fill: {rgb_to_svg_color(*params['rgb'])}"
-                        t = ET.SubElement(g, "text",
-                                          #x=f"{x:.3f}", y=f"{y:.3f}",
-                                          transform=f"matrix( {tm} )",
-                                          style=style)
-                        t.text = text
-                        t.set("font-size", f"{params['fs']}px")
-                        t.set("text-anchor", params.get('align', 'left'))
-                        t.set("dominant-baseline", 'hanging')
-                    else:
-                        print("Unknown", c)
-
-                    last = c
 
-                if start and start is not last and \
-                   points_equal(start[1], start[2], last[1], last[2]):
-                    p.append("Z")
+        # count the shapes to find the ones drawn more than once - first
+        # by hash only to not keep the coordinates of every path around
+        hashes: dict[int, int] = {}
+        keys = []  # per part: shape key (first its hash) of each path
+        # (rgb, line width) -> number of the layer
+        layers: dict[tuple[Any, str], int] = {}
+        part_layers = []  # per part: layer number of each path
+        for part in self.parts:
+            pkeys, players = [], []
+            for path in part.pathes:
+                path.faster_edges(inner_corners)
+                key = None
+                if self.instances and not path.texts and len(path.ops) > 1:
+                    key = hash(self._shape_key(path))
+                    hashes[key] = hashes.get(key, 0) + 1
+                pkeys.append(key)
+                if self.compact:
+                    players.append(layers.setdefault(
+                        self._layer_key(path.params), len(layers)))
+            keys.append(pkeys)
+            part_layers.append(players)
+        shapes: dict[Any, int] = {}
+        for part, pkeys in zip(self.parts, keys):
+            for j, path in enumerate(part.pathes):
+                if pkeys[j] is None or hashes[pkeys[j]] == 1:
+                    pkeys[j] = None
+                    continue
+                pkeys[j] = key = self._shape_key(path)
+                shapes[key] = shapes.get(key, 0) + 1
+        # forget the shapes drawn only once
+        for pkeys in keys:
+            for j, key in enumerate(pkeys):
+                if key is not None and shapes[key] == 1:
+                    pkeys[j] = None
+        del hashes, shapes
+        if layers:
+            style = ET.SubElement(svg, "style")
+            style.text = "\n.l {fill:none;stroke-linecap:round;stroke-linejoin:round}\ntext {stroke:none}\n"
+            for (rgb, lw), n in layers.items():
+                style.text += f".l-{n} {{stroke:{rgb_to_svg_color(*rgb)};stroke-width:{lw}}}\n"
+            style.tail = "\n"
+        # definitions in order of first use
+        symbols: dict[Any, str] = {}
+        for part, pkeys in zip(self.parts, keys):
+            for path, key in zip(part.pathes, pkeys):
+                if key is None or key in symbols:
+                    continue
+                if not symbols:
+                    defs = ET.SubElement(svg, "defs")
+                    defs.text = "\n  "
+                    defs.tail = "\n"
+                symbols[key] = f"s-{len(symbols)}"
+                x, y = path.coords[0], path.coords[1]
+                t = ET.SubElement(defs, "path", id=symbols[key],
+                                  d=self._path_data(defs, path, x, y))
                 color = (
                     random_svg_color()
                     if RANDOMIZE_COLORS
                     else rgb_to_svg_color(*path.params["rgb"])
                 )
-                if p and p[-1][0] == "M":
-                    p.pop()
-                if p:  # might be empty if only contains text
-                    t = ET.SubElement(g, "path", d=" ".join(p), stroke=color)
-                    t.set("stroke-width", f'{path.params["lw"]:.2f}')
-                    t.tail = "\n  "
-            t.tail = "\n"
-        tree.write(open(self._fname, "wb"), encoding="utf-8", xml_declaration=True, method="xml")
+                self._set_stroke(t, path, color)
+                t.tail = "\n  "
+        if symbols:
+            defs[-1].tail = "\n"
+        # replace the keys by the ids of the symbols
+        keys = [[None if key is None else symbols[key] for key in pkeys]
+                for pkeys in keys]
+        symbols.clear()
+
+        # Write the head and then the parts one by one to not keep the
+        # XML of the whole drawing in memory
+        if self.compact:
+            # one group per layer holding the paths of the parts in it
+            jobs = [(i, keys[i], part_layers[i], n)
+                    for n in layers.values()
+                    for i in range(len(self.parts)) if n in part_layers[i]]
+            labels = {n: color_name(rgb) for (rgb, lw), n in layers.items()}
+        else:
+            jobs = [(i, keys[i], None, None)
+                    for i, part in enumerate(self.parts) if part.pathes]
+        with open(self._fname, "w", encoding="utf-8", newline="\n") as f:
+            f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+            f.write(self._start_tag(svg, "</svg>"))
+            layer = None
+            for job, xml in zip(jobs, self._map_parts("_part_svg", jobs)):
+                n = job[3]
+                if n != layer:
+                    if layer is not None:
+                        f.write("</g>\n")
+                    layer = n
+                    l = ET.Element("g", id=f"l-{n}")
+                    l.set("class", f"l l-{n}")
+                    l.set("inkscape:groupmode", "layer")
+                    l.set("inkscape:label", labels[n])
+                    f.write(self._start_tag(l, "</g>"))
+                f.write(xml)
+            if layer is not None:
+                f.write("</g>\n")
+            f.write("</svg>")
+
+    def _shape_key(self, path):
+        """Equal for paths that look the same in the output - apart from
+        their position"""
+        return (bytes(path.ops), shape_coords(path.coords, self.precision),
+                params_key(path.params))
+
+    @staticmethod
+    def _start_tag(element, end_tag):
+        """Return element serialized up to its end tag"""
+        element.text = element.text or "\n"
+        s = ET.tostring(element, encoding="unicode")
+        return s[:s.rindex(end_tag)]
+
+    def _part_svg(self, part, i, symbols, layers, n):
+        """Return the group with the paths of part i as XML
+
+        symbols has the id of the symbol for each path drawn more than
+        once. In compact mode only the paths in layer n are added.
+        """
+        g = ET.Element("g", id=f"p-{i}-{n}" if self.compact else f"p-{i}")
+        g.text = "\n  "
+        g.tail = "\n"
+        if not self.compact:
+            g.set("style", "fill:none;stroke-linecap:round;stroke-linejoin:round;")
+        for j, (path, symbol) in enumerate(zip(part.pathes, symbols)):
+            if self.compact and layers[j] != n:
+                continue
+            color = (
+                random_svg_color()
+                if RANDOMIZE_COLORS
+                else rgb_to_svg_color(*path.params["rgb"])
+            )
+            if symbol is not None:
+                x, y = path.coords[0], path.coords[1]
+                t = ET.SubElement(g, "use", transform=f"translate({self._number(x)} {self._number(y)})")
+                t.set("xlink:href", "#" + symbol)
+                if self.compact and RANDOMIZE_COLORS:
+                    t.set("stroke", color)
+                t.tail = "\n  "
+                continue
+            p = self._path_data(g, path)
+            if p:  # might be empty if only contains text
+                t = ET.SubElement(g, "path", d=p)
+                self._set_stroke(t, path, color)
+                t.tail = "\n  "
+        if len(g):
+            g[-1].tail = "\n"
+        return ET.tostring(g, encoding="unicode")
+
+    @staticmethod
+    def _layer_key(params):
+        return tuple(params["rgb"]), f'{params["lw"]:.2f}'
+
+    def _set_stroke(self, t, path, color):
+        """Set the stroke attributes unless the layer takes care of them"""
+        if not self.compact:
+            t.set("stroke", color)
+            t.set("stroke-width", f'{path.params["lw"]:.2f}')
+        elif RANDOMIZE_COLORS:
+            t.set("stroke", color)
 
 class PSSurface(Surface):
 
@@ -662,68 +1801,10 @@ class PSSurface(Surface):
         # dwg['width']=f'{w:.2f}mm'
         # dwg['height']=f'{h:.2f}mm'
 
-        for i, part in enumerate(self.parts):
-            if not part.pathes:
-                continue
-            for j, path in enumerate(part.pathes):
-                p = []
-                x, y = 0, 0
-                path.faster_edges(inner_corners)
-
-                for c in path.path:
-                    x0, y0 = x, y
-                    C, x, y = c[0:3]
-                    if C == "M":
-                        p.append(f"{x:.3f} {y:.3f} moveto")
-                    elif C == "L":
-                        p.append(f"{x:.3f} {y:.3f} lineto")
-                    elif C == "C":
-                        x1, y1, x2, y2 = c[3:]
-                        p.append(
-                            f"{x1:.3f} {y1:.3f} {x2:.3f} {y2:.3f} {x:.3f} {y:.3f} curveto"
-                        )
-                    elif C == "T":
-                        m, text, params = c[3:]
-                        tm = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
-                        text = text.replace("(", "r\(").replace(")", r"\)")
-                        color = " ".join(f"{c:.2f}" for c in params["rgb"])
-                        align = params.get('align', 'left')
-                        f.write(f"/{self.fonts[params['ff']]}-Latin1 findfont\n")
-                        f.write(f"{params['fs']} scalefont\n")
-                        f.write("setfont\n")
-                        #f.write(f"currentfont /Encoding  ISOLatin1Encoding put\n")
-                        f.write(f"{color} setrgbcolor\n")
-                        f.write("matrix currentmatrix") # save current matrix
-                        f.write(f"[ {tm} ] concat\n")
-                        if align == "left":
-                            f.write(f"0.0\n")
-                        else:
-                            f.write(f"({text}) stringwidth pop ")
-                            if align == "middle":
-                                f.write(f"-0.5 mul\n")
-                            else: # end
-                                f.write(f"neg\n")
-                        # offset y by descender
-                        f.write("currentfont dup /FontBBox get 1 get \n")
-                        f.write("exch /FontMatrix get 3 get mul neg moveto \n")
-
-                        f.write(f"({text}) show\n") # text created by dup above
-                        f.write("setmatrix\n\n") # restore matrix
-                    else:
-                        print("Unknown", c)
-                color = (
-                    random_svg_color()
-                    if RANDOMIZE_COLORS
-                    else rgb_to_svg_color(*path.params["rgb"])
-                )
-                if p:  # todo: might be empty since text is not implemented yet
-                    color = " ".join(f"{c:.2f}" for c in path.params["rgb"])
-                    f.write("newpath\n")
-                    f.write("\n".join(p))
-                    f.write("\n")
-                    f.write(f"{path.params['lw']} setlinewidth\n")
-                    f.write(f"{color} setrgbcolor\n")
-                    f.write("stroke\n\n")
+        jobs = [(i, inner_corners)
+                for i, part in enumerate(self.parts) if part.pathes]
+        for ps in self._map_parts("_part_ps", jobs):
+            f.write(ps)
         f.write(
             """
 showpage
@@ -733,6 +1814,243 @@ showpage
         )
         f.close()
 
+    def _part_ps(self, part, i, inner_corners):
+        """Return the PostScript of part i"""
+        out = []
+        for j, path in enumerate(part.pathes):
+            p = []
+            x, y = 0, 0
+            path.faster_edges(inner_corners)
+            coords = path.coords
+            texts = iter(path.texts)
+            k = 0
+
+            for C in path.ops:
+                x0, y0 = x, y
+                x, y = coords[k], coords[k+1]
+                if C == MOVE:
+                    p.append(f"{x:.3f} {y:.3f} moveto")
+                elif C == LINE:
+                    p.append(f"{x:.3f} {y:.3f} lineto")
+                elif C == CURVE:
+                    x1, y1, x2, y2 = coords[k+2:k+6]
+                    p.append(
+                        f"{x1:.3f} {y1:.3f} {x2:.3f} {y2:.3f} {x:.3f} {y:.3f} curveto"
+                    )
+                elif C == ARC:
+                    cx, cy, qx, qy = coords[k+2:k+6]
+                    sweep = math.degrees(arc_sweep(x0, y0, cx, cy, qx, qy))
+                    r = math.hypot(x - cx, y - cy)
+                    a1 = math.degrees(math.atan2(y0 - cy, x0 - cx))
+                    p.append(f"{cx:.3f} {cy:.3f} {r:.3f} {a1:.3f} {a1 + sweep:.3f} "
+                             f"{'arc' if sweep > 0 else 'arcn'}")
+                elif C == TEXT:
+                    m, text, params = next(texts)
+                    tm = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
+                    text = text.replace("(", "r\(").replace(")", r"\)")
+                    color = " ".join(f"{c:.2f}" for c in params["rgb"])
+                    align = params.get('align', 'left')
+                    out.append(f"/{self.fonts[params['ff']]}-Latin1 findfont\n")
+                    out.append(f"{params['fs']} scalefont\n")
+                    out.append("setfont\n")
+                    #out.append(f"currentfont /Encoding  ISOLatin1Encoding put\n")
+                    out.append(f"{color} setrgbcolor\n")
+                    out.append("matrix currentmatrix") # save current matrix
+                    out.append(f"[ {tm} ] concat\n")
+                    if align == "left":
+                        out.append(f"0.0\n")
+                    else:
+                        out.append(f"({text}) stringwidth pop ")
+                        if align == "middle":
+                            out.append(f"-0.5 mul\n")
+                        else: # end
+                            out.append(f"neg\n")
+                    # offset y by descender
+                    out.append("currentfont dup /FontBBox get 1 get \n")
+                    out.append("exch /FontMatrix get 3 get mul neg moveto \n")
+
+                    out.append(f"({text}) show\n") # text created by dup above
+                    out.append("setmatrix\n\n") # restore matrix
+                else:
+                    print("Unknown", chr(C))
+                k += NARGS[C]
+            color = (
+                random_svg_color()
+                if RANDOMIZE_COLORS
+                else rgb_to_svg_color(*path.params["rgb"])
+            )
+            if p:  # todo: might be empty since text is not implemented yet
+                color = " ".join(f"{c:.2f}" for c in path.params["rgb"])
+                out.append("newpath\n")
+                out.append("\n".join(p))
+                out.append("\n")
+                out.append(f"{path.params['lw']} setlinewidth\n")
+                out.append(f"{color} setrgbcolor\n")
+                out.append("stroke\n\n")
+        return "".join(out)
+
+class PDFSurface(PSSurface):
+    """Writes PDF files directly
+
+    Uses the PDF standard fonts, so no fonts are embedded. The content
+    stream is written while the paths are processed.
+    """
+
+    compress = True  # Flate compress the page content
+
+    # widths of the WinAnsi characters 32 to 126 in 1/1000 of the font size
+    # (from the Adobe font metrics)
+    char_widths = {
+        "serif": [
+            250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250,
+            333, 250, 278, 500, 500, 500, 500, 500, 500, 500, 500, 500, 500,
+            278, 278, 564, 564, 564, 444, 921, 722, 667, 667, 722, 611, 556,
+            722, 722, 333, 389, 722, 611, 889, 722, 722, 556, 722, 667, 556,
+            611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500, 333,
+            444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778,
+            500, 500, 500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444,
+            480, 200, 480, 541],
+        "sans-serif": [
+            278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278,
+            333, 278, 278, 556, 556, 556, 556, 556, 556, 556, 556, 556, 556,
+            278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611,
+            778, 722, 278, 500, 667, 556, 833, 722, 778, 667, 778, 722, 667,
+            611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, 333,
+            556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833,
+            556, 556, 556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500,
+            334, 260, 334, 584],
+    }
+    # lower end of the font bounding box (see PSSurface)
+    descender = {"serif": 0.218, "sans-serif": 0.225, "monospaced": 0.25}
+
+    @staticmethod
+    def _string(text):
+        """PDF string literal for text"""
+        try:
+            data = text.encode("latin1")
+        except UnicodeEncodeError:
+            return "<" + ("\ufeff" + text).encode("utf-16-be").hex() + ">"
+        text = data.decode("latin1")
+        return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "\\r").replace("\n", "\\n") + ")"
+
+    def _text_width(self, text, style):
+        if style == "monospaced":
+            return 0.6 * len(text)
+        widths = self.char_widths[style]
+        return sum(widths[ord(c) - 32] if 32 <= ord(c) <= 126 else 556
+                   for c in text) / 1000
+
+    def _info(self):
+        md = self.metadata
+        info = {
+            "Title": "Boxes.py - {group} - {name}".format(**md),
+            "Subject": md["short_description"] or "",
+            "Keywords": "boxes.py, laser, laser cutter",
+            "Creator": md.get("url") or md["cli"],
+            "Producer": "Boxes.py (https://festi.info/boxes.py)",
+            "CreationDate": datetime.datetime.now().strftime("D:%Y%m%d%H%M%S"),
+        }
+        return "<< " + " ".join(f"/{k} {self._string(v)}" for k, v in info.items()) + " >>"
+
+    def finish(self, inner_corners="loop"):
+        extents = self._adjust_coordinates()
+
+        fonts: dict[Any, str] = {}
+        for part in self.parts:
+            for path in part.pathes:
+                for m, text, params in path.texts:
+                    fonts.setdefault(params["ff"], f"F{len(fonts)}")
+
+        f = open(self._fname, "wb")
+        offsets = []
+
+        def obj(content):
+            offsets.append(f.tell())
+            f.write(f"{len(offsets)} 0 obj\n{content}\nendobj\n".encode("latin1"))
+
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        f.write(self._metadata().encode("latin1", "replace"))
+        obj("<< /Type /Catalog /Pages 2 0 R >>")
+        obj("<< /Type /Pages /Kids [3 0 R] /Count 1 >>")
+        font_objs = " ".join(f"/{name} {6 + i} 0 R"
+                             for i, name in enumerate(fonts.values()))
+        obj(f"<< /Type /Page /Parent 2 0 R "
+            f"/MediaBox [0 0 {extents.width:.3f} {extents.height:.3f}] "
+            f"/Resources << /Font << {font_objs} >> >> /Contents 4 0 R >>")
+
+        # content stream, its length follows as object 5
+        offsets.append(f.tell())
+        f.write(b"4 0 obj\n<< /Length 5 0 R")
+        f.write(b" /Filter /FlateDecode >>\nstream\n" if self.compress
+                else b" >>\nstream\n")
+        start = f.tell()
+        compressor = zlib.compressobj() if self.compress else None
+
+        def write(data):
+            data = data.encode("latin1")
+            f.write(compressor.compress(data) if compressor else data)
+
+        write("1 J 1 j\n")
+        for part in self.parts:
+            for path in part.pathes:
+                path.faster_edges(inner_corners)
+                p = []
+                coords = path.coords
+                texts = iter(path.texts)
+                k = 0
+                x, y = 0, 0
+                for C in path.ops:
+                    x0, y0 = x, y
+                    x, y = coords[k], coords[k+1]
+                    if C == MOVE:
+                        p.append(f"{x:.3f} {y:.3f} m")
+                    elif C == LINE:
+                        p.append(f"{x:.3f} {y:.3f} l")
+                    elif C == CURVE:
+                        x1, y1, x2, y2 = coords[k+2:k+6]
+                        p.append(f"{x1:.3f} {y1:.3f} {x2:.3f} {y2:.3f} {x:.3f} {y:.3f} c")
+                    elif C == ARC:
+                        # PDF has no arcs
+                        for curve in arc_beziers(x0, y0, *coords[k:k+6]):
+                            p.append("{:.3f} {:.3f} {:.3f} {:.3f} {:.3f} {:.3f} c".format(*curve))
+                    elif C == TEXT:
+                        m, text, params = next(texts)
+                        style = params["ff"][0]
+                        fs = params["fs"]
+                        dx = {"left": 0, "middle": -0.5, "end": -1}[params.get("align", "left")]
+                        m = m * Affine.translation(
+                            dx * fs * self._text_width(text, style),
+                            self.descender[style] * fs)
+                        tm = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
+                        color = " ".join(f"{c:.2f}" for c in params["rgb"])
+                        text = self._string(text.encode("cp1252", "replace").decode("latin1"))
+                        write(f"BT /{fonts[params['ff']]} {fs} Tf {color} rg "
+                              f"{tm} Tm {text} Tj ET\n")
+                    else:
+                        print("Unknown", chr(C))
+                    k += NARGS[C]
+                if p:
+                    color = " ".join(f"{c:.2f}" for c in path.params["rgb"])
+                    write("\n".join(p))
+                    write(f"\n{path.params['lw']} w {color} RG S\n")
+        if compressor:
+            f.write(compressor.flush())
+        length = f.tell() - start
+        f.write(b"\nendstream\nendobj\n")
+        obj(str(length))
+        for font in fonts:
+            obj(f"<< /Type /Font /Subtype /Type1 /BaseFont /{self.fonts[font]} "
+                "/Encoding /WinAnsiEncoding >>")
+        obj(self._info())
+
+        xref = f.tell()
+        f.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R "
+                f"/Info {len(offsets)} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+        f.close()
+
 class LBRN2Surface(Surface):
 
 
@@ -756,232 +2074,732 @@ class LBRN2Surface(Surface):
         8,  # Colors.OUTER_CUT    (WHITE)   --> Lightburn C08 (grey)
         ]
 
+    # (cut index, name, type) of the layers in the order they are cut
+    cut_settings = [
+        (3, "Etch", "Cut"),         # green layer (ETCHING)
+        (6, "Deep Etch", "Cut"),    # cyan layer (ETCHING_DEEP)
+        (7, "C07", "Cut"),          # magenta layer (MAGENTA)
+        (4, "C04", "Cut"),          # yellow layer (YELLOW)
+        (8, "C08", "Cut"),          # grey layer (WHITE)
+        (1, "Inner Cut", "Cut"),    # blue layer (INNER_CUT)
+        (0, "Outer Cut", "Cut"),    # black layer (OUTER_CUT)
+        (30, "T1", "Tool"),         # T1 layer (ANNOTATIONS) is not cut at all
+                                    # tool layer do not support names
+        ]
+
+    def _cut_index(self, rgb):
+        return self.lbrn2_colors[4*int(rgb[0])+2*int(rgb[1])+int(rgb[2])]
+
+    def _used_cut_indices(self):
+        used = set()
+        for part in self.parts:
+            for path in part.pathes:
+                if any(C not in (MOVE, TEXT) for C in path.ops):
+                    used.add(self._cut_index(path.params["rgb"]))
+                for m, text, params in path.texts:
+                    if text:
+                        used.add(self._cut_index(params["rgb"]))
+        return used
+
     def finish(self, inner_corners="loop"):
         if self.dbg: print("LBRN2 save")
         extents = self._adjust_coordinates()
-        w = extents.width * self.scale
-        h = extents.height * self.scale
 
         svg = ET.Element('LightBurnProject', AppVersion="1.0.06", FormatVersion="1", MaterialHeight="0", MirrorX="False", MirrorY="False")
         svg.text = "\n"
-        num = 0
-        txtOffset = {}
 
-        tree = ET.ElementTree(svg)
-        if self.dbg: print ("8", num)
-        
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="3")         # green layer (ETCHING)
-        name     = ET.SubElement(cs, "name",     Value="Etch")
-        priority = ET.SubElement(cs, "priority", Value="0")         # is cut first
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="6")         # cyan layer (ETCHING_DEEP)
-        name     = ET.SubElement(cs, "name",     Value="Deep Etch")
-        priority = ET.SubElement(cs, "priority", Value="1")         # is cut second
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="7")         # magenta layer (MAGENTA)
-        name     = ET.SubElement(cs, "name",     Value="C07")
-        priority = ET.SubElement(cs, "priority", Value="2")         # is cut third
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="4")         # yellow layer (YELLOW)
-        name     = ET.SubElement(cs, "name",     Value="C04")
-        priority = ET.SubElement(cs, "priority", Value="3")         # is cut third
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="8")         # grey layer (WHITE)
-        name     = ET.SubElement(cs, "name",     Value="C08")
-        priority = ET.SubElement(cs, "priority", Value="4")         # is cut fourth
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="1")         # blue layer (INNER_CUT)
-        name     = ET.SubElement(cs, "name",     Value="Inner Cut")
-        priority = ET.SubElement(cs, "priority", Value="5")         # is cut fifth
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Cut")
-        index    = ET.SubElement(cs, "index",    Value="0")         # black layer (OUTER_CUT)
-        name     = ET.SubElement(cs, "name",     Value="Outer Cut")
-        priority = ET.SubElement(cs, "priority", Value="6")         # is cut sixth
-
-        cs = ET.SubElement(svg, "CutSetting", Type="Tool")
-        index    = ET.SubElement(cs, "index",    Value="30")        # T1 layer (ANNOTATIONS)
-        name     = ET.SubElement(cs, "name",     Value="T1")        # tool layer do not support names
-        priority = ET.SubElement(cs, "priority", Value="7")         # is not cut at all
-                
+        used = self._used_cut_indices()
+        for priority, (index, name, type_) in enumerate(self.cut_settings):
+            if index not in used:
+                continue
+            cs = ET.SubElement(svg, "CutSetting", Type=type_)
+            ET.SubElement(cs, "index", Value=str(index))
+            ET.SubElement(cs, "name", Value=name)
+            ET.SubElement(cs, "priority", Value=str(priority))
+
+        # Write the head and then the parts one by one to not keep the
+        # XML of the whole drawing in memory
+        out = open(self._fname, "w", encoding="utf-8", newline="\n")
+        out.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        head = ET.tostring(svg, encoding="unicode")
+        out.write(head[:head.rindex("</LightBurnProject>")])
+
+        txtOffset = {}
         for i, part in enumerate(self.parts):
-            if self.dbg: print ("7", num)
+            if self.dbg: print("part", i)
             if not part.pathes:
                 continue
-            gp = ET.SubElement(svg, "Shape", Type="Group")
+            gp = ET.Element("Shape", Type="Group")
             gp.text = "\n  "
             gp.tail = "\n"
             children = ET.SubElement(gp, "Children")
             children.text = "\n  "
             children.tail = "\n"
-            
-            for j, path in enumerate(part.pathes):
-                myColor = self.lbrn2_colors[4*int(path.params["rgb"][0])+2*int(path.params["rgb"][1])+int(path.params["rgb"][2])]
+            for path in part.pathes:
+                self._add_path(children, path, inner_corners, txtOffset)
+            out.write(ET.tostring(gp, encoding="unicode"))
 
-                p = []
-                x, y = 0, 0
-                C = ""
-                start = None
-                last = None
+        url = self.metadata["url"].replace("&render=1", "") # remove render argument to get web form again
+
+        pl = ET.Element("Notes", ShowOnLoad="1", Notes="File created by Boxes.py script, programmed by Florian Festi.\nLightburn output by Klaus Steinhammer.\n\nURL with settings:\n" + str(url))
+        pl.text = ""
+        pl.tail = "\n"
+
+        out.write(ET.tostring(pl, encoding="unicode"))
+        out.write("</LightBurnProject>")
+        out.close()
+
+    def _add_shape(self, children, type_, cut_index, **attrs):
+        sh = ET.SubElement(children, "Shape", Type=type_,
+                           CutIndex=str(cut_index), **attrs)
+        sh.text = "\n  "
+        sh.tail = "\n"
+        return sh
+
+    def _add_path(self, children, path, inner_corners, txtOffset):
+        """Add the shapes of path to children"""
+        myColor = self._cut_index(path.params["rgb"])
+
+        if path.ops == b"MA" and points_equal(*path.coords[0:2], *path.coords[2:4]):
+            # a circle
+            x, y, cx, cy = path.coords[2:6]
+            r = math.hypot(x - cx, y - cy)
+            sh = self._add_shape(children, "Ellipse", myColor, Rx=f"{r:.3f}", Ry=f"{r:.3f}")
+            xf = ET.SubElement(sh, "XForm")
+            xf.text = f"1 0 0 1 {cx:.3f} {cy:.3f}"
+            xf.tail = "\n"
+            return
+
+        path.faster_edges(inner_corners)
+        ops, coords = path.ops, path.coords
+        offsets = path.offsets()
+        texts = iter(path.texts)
+        ende = len(ops) - 1
+        num = 0
+        C = ops[0]
+        while num < ende or (C == TEXT and num <= ende):
+            C, k = ops[num], offsets[num]
+            if C == MOVE:
+                num = self._add_subpath(children, myColor, ops, coords,
+                                        offsets, num, ende)
+                C = ops[num]
+            elif C == TEXT:
+                self._add_text(children, next(texts), txtOffset)
+                num += 1
+            else:
+                print("next, because not M")
+                num += 1
+
+    def _add_subpath(self, children, myColor, ops, coords, offsets, num, ende):
+        """Add the lines starting with the MOVE at ops[num] as one shape
+
+        Vertices and primitives are collected in lists and joined once.
+        Returns the index of the op ending the shape.
+        """
+        k = offsets[num]
+        x, y = coords[k], coords[k+1]
+        vl = [f"V{x:.3f} {y:.3f}c0x1c1x1"]
+        pl = []
+        closed = False
+        start = (x, y)
+        x0, y0 = x, y
+        cnt = 1
+        bspline = False
+        while num < ende:
+            num += 1
+            C, k = ops[num], offsets[num]
+            x, y = coords[k], coords[k+1]
+            if C == MOVE:
+                if points_equal(*start, x, y):
+                    closed = True
+                start = (x, y)
+                break
+            elif C == TEXT:
+                break
+            elif C == LINE:
+                vl.append(f"V{x:.3f} {y:.3f}c0x1c1x1")
+                pl.append(f"L{cnt-1} {cnt}")
+                cnt += 1
+            elif C == CURVE:
+                x1, y1, x2, y2 = coords[k+2:k+6]
+                vl.append(f"V{x0:.3f} {y0:.3f}c0x{x1:.3f}c0y{y1:.3f}c1x1V{x:.3f} {y:.3f}c0x1c1x{x2:.3f}c1y{y2:.3f}")
+                pl.append(f"L{cnt-1} {cnt}B{cnt} {cnt+1}")
+                cnt += 2
+                bspline = True
+            elif C == ARC:
+                for x1, y1, x2, y2, x3, y3 in arc_beziers(x0, y0, *coords[k:k+6]):
+                    vl.append(f"V{x0:.3f} {y0:.3f}c0x{x1:.3f}c0y{y1:.3f}c1x1V{x3:.3f} {y3:.3f}c0x1c1x{x2:.3f}c1y{y2:.3f}")
+                    pl.append(f"L{cnt-1} {cnt}B{cnt} {cnt+1}")
+                    cnt += 2
+                    x0, y0 = x3, y3
+                bspline = True
+            else:
+                print("unknown", chr(C))
+            x0, y0 = x, y
+        if not bspline and points_equal(*start, x0, y0):
+            closed = True
+
+        sh = self._add_shape(children, "Path", myColor)
+        t = ET.SubElement(sh, "VertList")
+        t.text = "".join(vl)
+        t.tail = "\n"
+        t = ET.SubElement(sh, "PrimList")
+        t.text = "LineClosed" if closed else "".join(pl)
+        t.tail = "\n"
+        return num
+
+    def _add_text(self, children, text_data, txtOffset):
+        m, text, params = text_data
+        m = m * Affine.translation(0, params['fs'])
+        font, bold, italic = params['ff']
+        if params.get('font', 'Arial')=='Arial':
+            f = self.fonts[font]
+        else:
+            f = params.get('font', 'Arial')
+        fontColor = self._cut_index(params["rgb"])
+
+        #alignment can be left|middle|end
+        if params.get('align', 'left')=='middle':
+            hor = '1'
+        else:
+            if params.get('align', 'left')=='end':
+                hor = '2'
+            else:
+                hor = '0'
+        ver = 1 # vertical is always bottom, text is shifted in box class
+
+        pos = text.find('%')
+        offs = 0
+        if pos >- 1:
+            texttype = '2'
+            if text[pos+1:pos+2].isnumeric():
+                if text[pos+1:pos+3].isnumeric() and len(text[pos+1:pos+3]) == 2:
+                    var = text[pos:pos+3]
+                else:
+                    var = text[pos:pos+2]
+                if var in txtOffset:
+                    offs = txtOffset[var] + 1
+                txtOffset[var] = offs
+            else:
+                texttype = '0'
+        else:
+            texttype = '0'
+
+        if not text:
+            if self.dbg: print ("T: text with empty string")
+            return
+        sh = self._add_shape(children, "Text", fontColor, Font=f"{f}", H=f"{(params['fs']*1.75*0.6086434):.3f}", Str=f"{text}", Bold=f"{'1' if bold else '0'}", Italic=f"{'1' if italic else '0'}", Ah=f"{str(hor)}", Av=f"{str(ver)}", Eval=f"{texttype}", VariableOffset=f"{str(offs)}")  # 1mm = 1.75 Lightburn H units
+        xf = ET.SubElement(sh, "XForm")
+        xf.text = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
+        xf.tail = "\n"
+
+class DXFSurface(Surface):
+    """Writes DXF R12 files directly
+
+    Every color gets its own layer. Paths become LINE, CIRCLE or POLYLINE
+    entities. Arcs are stored as bulges of the polyline vertices, curves
+    are flattened unless they are circular arcs, too.
+    """
+
+    flatness = 0.05  # max deviation of flattened curves in mm
+
+    # AutoCAD color index of the layers
+    layer_colors = {
+        "OUTER_CUT": 7,      # BLACK (shown white on black background)
+        "INNER_CUT": 5,      # BLUE
+        "ETCHING": 3,        # GREEN
+        "ETCHING_DEEP": 4,   # CYAN
+        "ANNOTATIONS": 1,    # RED
+        "MAGENTA": 6,
+        "YELLOW": 2,
+        "WHITE": 9,          # light grey
+    }
+
+    def _metadata(self):
+        md = self.metadata
+        lines = [
+            "Boxes.py - {group} - {name}".format(**md),
+            f'Creation date: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}',
+            "Created by Boxes.py (https://festi.info/boxes.py)",
+            f'Command line: {md["cli"]}',
+        ]
+        if md["url"]:
+            lines.append(f'Url: {md["url"]}')
+        return "".join(f"999\n{l}\n" for l in lines)
+
+    def _polyline(self, f, layer, verts):
+        if len(verts) < 2:
+            return
+        closed = len(verts) > 2 and points_equal(*verts[0][:2], *verts[-1][:2])
+        if closed:
+            verts.pop()
+        if len(verts) == 2 and not closed and not verts[0][2]:
+            (x1, y1, _), (x2, y2, _) = verts
+            f.write(f"  0\nLINE\n  8\n{layer}\n 10\n{x1:.4f}\n 20\n{y1:.4f}\n"
+                    f" 11\n{x2:.4f}\n 21\n{y2:.4f}\n")
+            return
+        if (len(verts) == 2 and closed and
+                abs(abs(verts[0][2]) - 1) < EPS and
+                abs(verts[0][2] - verts[1][2]) < EPS):
+            (x1, y1, _), (x2, y2, _) = verts
+            f.write(f"  0\nCIRCLE\n  8\n{layer}\n 10\n{(x1 + x2) / 2:.4f}\n"
+                    f" 20\n{(y1 + y2) / 2:.4f}\n"
+                    f" 40\n{math.hypot(x2 - x1, y2 - y1) / 2:.4f}\n")
+            return
+        f.write(f"  0\nPOLYLINE\n  8\n{layer}\n 66\n1\n"
+                f" 10\n0.0\n 20\n0.0\n 30\n0.0\n 70\n{int(closed)}\n")
+        for x, y, bulge in verts:
+            f.write(f"  0\nVERTEX\n  8\n{layer}\n 10\n{x:.4f}\n 20\n{y:.4f}\n")
+            if bulge:
+                f.write(f" 42\n{bulge:.6f}\n")
+        f.write(f"  0\nSEQEND\n  8\n{layer}\n")
+
+    def _text(self, f, m, text, params):
+        fs = params["fs"]
+        # PS puts the descender above the origin
+        x, y = m * (0, 0.2 * fs)
+        height = fs * math.sqrt(abs(m.determinant))
+        angle = math.degrees(math.atan2(m.d, m.a))
+        align = {"left": 0, "middle": 1, "end": 2}[params.get("align", "left")]
+        f.write(f"  0\nTEXT\n  8\n{color_name(params['rgb'])}\n"
+                f" 10\n{x:.4f}\n 20\n{y:.4f}\n 40\n{height:.4f}\n"
+                f"  1\n{text}\n 50\n{angle:.4f}\n")
+        if align:
+            f.write(f" 72\n{align}\n 11\n{x:.4f}\n 21\n{y:.4f}\n")
+
+    def finish(self, inner_corners="loop"):
+        extents = self._adjust_coordinates()
+
+        layers = set()
+        for part in self.parts:
+            for path in part.pathes:
+                layers.add(color_name(path.params["rgb"]))
+                for m, text, params in path.texts:
+                    layers.add(color_name(params["rgb"]))
+
+        f = open(self._fname, "w", encoding="cp1252", errors="replace")
+        f.write(self._metadata())
+        f.write("  0\nSECTION\n  2\nHEADER\n"
+                "  9\n$ACADVER\n  1\nAC1009\n"
+                "  9\n$DWGCODEPAGE\n  3\nANSI_1252\n"
+                "  9\n$INSUNITS\n 70\n4\n"
+                f"  9\n$EXTMIN\n 10\n0.0\n 20\n0.0\n 30\n0.0\n"
+                f"  9\n$EXTMAX\n 10\n{extents.width:.4f}\n"
+                f" 20\n{extents.height:.4f}\n 30\n0.0\n"
+                "  0\nENDSEC\n")
+        f.write("  0\nSECTION\n  2\nTABLES\n"
+                "  0\nTABLE\n  2\nLTYPE\n 70\n1\n"
+                "  0\nLTYPE\n  2\nCONTINUOUS\n 70\n0\n  3\nSolid line\n"
+                " 72\n65\n 73\n0\n 40\n0.0\n"
+                "  0\nENDTAB\n"
+                f"  0\nTABLE\n  2\nLAYER\n 70\n{len(layers)}\n")
+        for name in COLOR_NAMES:
+            if name in layers:
+                f.write(f"  0\nLAYER\n  2\n{name}\n 70\n0\n 62\n{self.layer_colors[name]}\n"
+                        "  6\nCONTINUOUS\n")
+        f.write("  0\nENDTAB\n  0\nENDSEC\n")
+
+        f.write("  0\nSECTION\n  2\nENTITIES\n")
+        for part in self.parts:
+            for path in part.pathes:
                 path.faster_edges(inner_corners)
-                num = 0
-                cnt = 1
-                ende = len(path.path)-1
-                if self.dbg: 
-                    for c in path.path:
-                        print ("6",num, c)
-                        num += 1
-                    num = 0
-                    
-                c = path.path[num]
-                C, x, y = c[0:3]
-                if self.dbg: print("ende:" ,ende)
-                while num < ende or (C == "T" and num <= ende): #len(path.path):
-                    if self.dbg: print ("0", num)
-                    c = path.path[num]
-                    if self.dbg: print("first: ", num, c)
-
-                    C, x, y = c[0:3]
-                    if C == "M":
-                        if self.dbg: print ("1", num)
-                        sh = ET.SubElement(children, "Shape", Type="Path", CutIndex=str(myColor))
-                        sh.text = "\n  "
-                        sh.tail = "\n"
-                        vl = ET.SubElement(sh, "VertList")
-                        vl.text = f"V{x:.3f} {y:.3f}c0x1c1x1"
-                        vl.tail = "\n"
-                        pl = ET.SubElement(sh, "PrimList")
-                        pl.text = ""#f"L{cnt} {cnt+1}"
-                        pl.tail = "\n"
-                        start = c
-                        x0, y0 = x, y
-                        # do something with M
-                        done = False
-                        bspline = False
-                        while done == False and num < ende: #len(path.path):
-                            num += 1
-                            c = path.path[num]
-                            if self.dbg: print ("next: ",num, c)
-                            C, x, y = c[0:3]
-                            if C == "M":
-                                if start and points_equal(start[1], start[2], x, y):
-                                    pl.text = "LineClosed"
-                                start = c
-                                cnt = 1
-                                if self.dbg: print ("next, because M")
-                                done = True
-                            elif C == "T":
-                                if self.dbg: print ("next, because T")
-                                done = True
-                            else:
-                                if C == "L":
-                                    vl.text+=(f"V{x:.3f} {y:.3f}c0x1c1x1")
-                                    pl.text += f"L{cnt-1} {cnt}"
-                                    cnt +=1
-                                elif C == "C":
-                                    x1, y1, x2, y2 = c[3:]
-                                    if self.dbg: print ("C: ",x0, y0, x1, y1, x, y, x2, y2)
-                                    vl.text+=(f"V{x0:.3f} {y0:.3f}c0x{(x1):.3f}c0y{(y1):.3f}c1x1V{x:.3f} {y:.3f}c0x1c1x{(x2):.3f}c1y{(y2):.3f}")
-                                    pl.text += f"L{cnt-1} {cnt}B{cnt} {cnt+1}"
-                                    cnt +=2
-                                    bspline = True
-                                else:
-                                    print("unknown", c)
-                            if done == False:
-                                x0, y0 = x, y
-                
-                        if start and points_equal(start[1], start[2], x0, y0):
-                                if bspline == False:
-                                    pl.text = "LineClosed"
-                        start = c
-                        if self.dbg: print ("2", num)
-                    elif C == "T":
-                        cnt = 1
-                        #C = ""
-                        if self.dbg: print ("3", num)
-                        m, text, params = c[3:]
-                        m = m * Affine.translation(0, params['fs'])
-                        if self.dbg: print ("T: ",x, y, c)
-                        num += 1
-                        font, bold, italic = params['ff']
-                        if params.get('font', 'Arial')=='Arial':
-                            f = self.fonts[font]
+                layer = color_name(path.params["rgb"])
+                coords = path.coords
+                texts = iter(path.texts)
+                verts: list[list[float]] = []
+                k = 0
+                for C in path.ops:
+                    x, y = coords[k], coords[k+1]
+                    if C == MOVE:
+                        self._polyline(f, layer, verts)
+                        verts = [[x, y, 0.0]]
+                    elif C == LINE:
+                        verts.append([x, y, 0.0])
+                    elif C == CURVE:
+                        x0, y0 = verts[-1][:2]
+                        x1, y1, x2, y2 = coords[k+2:k+6]
+                        arc = bezier_arc(x0, y0, x1, y1, x2, y2, x, y)
+                        if arc:
+                            verts[-1][2] = math.tan(arc[2] / 4)
+                            verts.append([x, y, 0.0])
                         else:
-                            f = params.get('font', 'Arial')
-                        fontColor = self.lbrn2_colors[4*int(params["rgb"][0])+2*int(params["rgb"][1])+int(params["rgb"][2])]
+                            verts.extend([px, py, 0.0] for px, py in bezier_points(
+                                x0, y0, x1, y1, x2, y2, x, y, self.flatness))
+                    elif C == ARC:
+                        x0, y0 = verts[-1][:2]
+                        cx, cy, qx, qy = coords[k+2:k+6]
+                        sweep = arc_sweep(x0, y0, cx, cy, qx, qy)
+                        if abs(sweep) > math.pi:
+                            # bulges are limited to half circles
+                            a = math.atan2(y0 - cy, x0 - cx) + 0.5 * sweep
+                            r = math.hypot(x0 - cx, y0 - cy)
+                            sweep *= 0.5
+                            verts[-1][2] = math.tan(sweep / 4)
+                            verts.append([cx + r * math.cos(a), cy + r * math.sin(a), 0.0])
+                        verts[-1][2] = math.tan(sweep / 4)
+                        verts.append([x, y, 0.0])
+                    elif C == TEXT:
+                        self._polyline(f, layer, verts)
+                        verts = [[x, y, 0.0]]
+                        self._text(f, *next(texts))
+                    else:
+                        print("Unknown", chr(C))
+                    k += NARGS[C]
+                self._polyline(f, layer, verts)
+        f.write("  0\nENDSEC\n  0\nEOF\n")
+        f.close()
 
-                        #alignment can be left|middle|end
-                        if params.get('align', 'left')=='middle':
-                            hor = '1'
+class GCodeSurface(Surface):
+    """Writes G-code for laser cutters
+
+    Every color has its own power and speed. The paths are grouped by
+    color and the groups are cut in the order of the profiles. Arcs and
+    curves that are circular arcs become G2/G3 moves, other curves are
+    flattened. Texts are left out.
+    """
+
+    flatness = 0.05  # max deviation of flattened curves in mm
+
+    # color name: (power as S value, feed in mm/min) or None to skip
+    profiles: dict[str, tuple[float, float] | None] = {
+        "ETCHING": (300, 3000),
+        "ETCHING_DEEP": (600, 1500),
+        "INNER_CUT": (1000, 300),
+        "MAGENTA": (1000, 300),
+        "YELLOW": (1000, 300),
+        "WHITE": (1000, 300),
+        "OUTER_CUT": (1000, 300),
+        "ANNOTATIONS": None,
+    }
+    # feed of travel moves in mm/min. None uses G0 rapids instead of G1
+    rapid_feed: float | None = None
+
+    def _metadata(self):
+        md = self.metadata
+        return (f"; Boxes.py - {md['group']} - {md['name']}\n"
+                f'; Creation date: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n'
+                f"; Command line: {md['cli']}\n")
+
+    def finish(self, inner_corners="loop"):
+        self._adjust_coordinates()
+
+        groups: dict[str, list[Path]] = {name: [] for name in self.profiles}
+        for part in self.parts:
+            for path in part.pathes:
+                name = color_name(path.params["rgb"])
+                if self.profiles.get(name):
+                    path.faster_edges(inner_corners)
+                    groups[name].append(path)
+
+        f = open(self._fname, "w", encoding="ascii", errors="replace")
+        f.write(self._metadata())
+        f.write("G21\nG90\nM5\n")
+        x = y = math.nan  # position unknown
+        feed = None  # last F value written
+        for name, paths in groups.items():
+            if not paths:
+                continue
+            power, speed = self.profiles[name]
+            f.write(f"; {name}\n")
+            for path in paths:
+                coords = path.coords
+                on = False
+                k = 0
+                for C in path.ops:
+                    x0, y0 = x, y
+                    x, y = coords[k], coords[k+1]
+                    k += NARGS[C]
+                    if C == TEXT:
+                        x, y = x0, y0
+                        continue
+                    if C == MOVE:
+                        if points_equal(x0, y0, x, y):
+                            continue
+                        if on:
+                            f.write("M5\n")
+                            on = False
+                        if self.rapid_feed is None:
+                            f.write(f"G0 X{x:.3f} Y{y:.3f}\n")
                         else:
-                            if params.get('align', 'left')=='end':
-                                hor = '2'
-                            else:
-                                hor = '0'
-                        ver = 1 # vertical is always bottom, text is shifted in box class
-                        
-                        pos = text.find('%')
-                        offs = 0
-                        if pos >- 1:
-                            if self.dbg: print ("p: ", pos, text[pos+1:pos+3])
-                            texttype = '2'
-                            if self.dbg: print("l ", len(text[pos+1:pos+3]))
-                            if text[pos+1:pos+2].isnumeric():
-                                if self.dbg: print ("t0", text[pos+1:pos+3])
-                                if text[pos+1:pos+3].isnumeric() and len(text[pos+1:pos+3]) == 2:
-                                    if self.dbg: print ("t1")
-                                    if text[pos:pos+3] in txtOffset:
-                                        if self.dbg: print ("t2")
-                                        offs = txtOffset[text[pos:pos+3]] + 1
-                                    else:
-                                        if self.dbg: print ("t3")
-                                        offs = 0
-                                    txtOffset[text[pos:pos+3]] = offs
-                                else:
-                                    if self.dbg: print ("t4")
-                                    if text[pos:pos+2] in txtOffset:
-                                        if self.dbg: print ("t5")
-                                        offs = txtOffset[text[pos:pos+2]] + 1
-                                    else:
-                                        offs = 0
-                                        if self.dbg: print ("t6")
-                                    txtOffset[text[pos:pos+2]] = offs
-                            else:
-                                if self.dbg: print ("t7")
-                                texttype = '0'
+                            f.write(f"G1 X{x:.3f} Y{y:.3f} F{self.rapid_feed}\n")
+                            feed = self.rapid_feed
+                        continue
+                    if points_equal(x0, y0, x, y) and C == LINE:
+                        continue
+                    if not on:
+                        f.write(f"M4 S{power}\n")
+                        on = True
+                    F = ""
+                    if feed != speed:
+                        F = f" F{speed}"
+                        feed = speed
+                    if C == LINE:
+                        f.write(f"G1 X{x:.3f} Y{y:.3f}{F}\n")
+                    elif C == CURVE:
+                        x1, y1, x2, y2 = coords[k-4:k]
+                        arc = bezier_arc(x0, y0, x1, y1, x2, y2, x, y)
+                        if arc:
+                            cx, cy, sweep = arc
+                            f.write(f"{'G3' if sweep > 0 else 'G2'} X{x:.3f} Y{y:.3f} "
+                                    f"I{cx - x0:.3f} J{cy - y0:.3f}{F}\n")
                         else:
-                            texttype = '0'
-                            if self.dbg: print ("t8")
-                        if self.dbg: print ("o: ", text, txtOffset, offs)
+                            for px, py in bezier_points(x0, y0, x1, y1, x2, y2,
+                                                        x, y, self.flatness):
+                                f.write(f"G1 X{px:.3f} Y{py:.3f}{F}\n")
+                                F = ""
+                    elif C == ARC:
+                        cx, cy, qx, qy = coords[k-4:k]
+                        sweep = arc_sweep(x0, y0, cx, cy, qx, qy)
+                        f.write(f"{'G3' if sweep > 0 else 'G2'} X{x:.3f} Y{y:.3f} "
+                                f"I{cx - x0:.3f} J{cy - y0:.3f}{F}\n")
+                if on:
+                    f.write("M5\n")
+        f.write("G0 X0 Y0\nM2\n")
+        f.close()
+
+
+class HPGLSurface(Surface):
+    """Writes HP-GL for plotters, vinyl and laser cutters
+
+    Every color is drawn with its own pen and velocity. The paths are
+    grouped by color and drawn in the order of the pens. Arcs and curves
+    that are circular arcs become AA commands, other curves are flattened. Texts become labels
+    if their color has a pen.
+    """
+
+    scale = 40.0  # plotter units per mm
+    flatness = 0.05  # max deviation of flattened curves in mm
+
+    # color name: (pen number, velocity in cm/s or None) or None to skip
+    pens: dict[str, tuple[int, float | None] | None] = {
+        "ETCHING": (3, None),
+        "ETCHING_DEEP": (4, None),
+        "INNER_CUT": (2, None),
+        "MAGENTA": (5, None),
+        "YELLOW": (6, None),
+        "WHITE": (7, None),
+        "OUTER_CUT": (1, None),
+        "ANNOTATIONS": None,
+    }
+
+    def _text(self, f, m, text, params):
+        fs = params["fs"]
+        x, y = m * (0, 0.2 * fs)
+        size = fs * math.sqrt(abs(m.determinant)) / self.scale / 10  # cm
+        angle = math.atan2(m.d, m.a)
+        origin = {"left": 1, "middle": 4, "end": 7}[params.get("align", "left")]
+        f.write(f"PU{x:.0f},{y:.0f};DI{math.cos(angle):.4f},{math.sin(angle):.4f};"
+                f"SI{0.5 * size:.3f},{0.7 * size:.3f};LO{origin};"
+                f"LB{text}\x03\n")
 
-                        if not text:
-                            if self.dbg: print ("T: text with empty string - ",x, y, c)
+    def finish(self, inner_corners="loop"):
+        self._adjust_coordinates()
+
+        groups: dict[str, list[Path]] = {name: [] for name in self.pens}
+        for part in self.parts:
+            for path in part.pathes:
+                name = color_name(path.params["rgb"])
+                if self.pens.get(name):
+                    path.faster_edges(inner_corners)
+                    groups[name].append(path)
+
+        f = open(self._fname, "w", encoding="ascii", errors="replace")
+        f.write("IN;\n")
+        flatness = self.flatness * self.scale
+        for name, paths in groups.items():
+            if not paths:
+                continue
+            pen, velocity = self.pens[name]
+            f.write(f"SP{pen};\n")
+            if velocity:
+                f.write(f"VS{velocity};\n")
+            for path in paths:
+                coords = path.coords
+                texts = iter(path.texts)
+                pd: list[str] = []  # points of the current PD command
+                x = y = math.nan  # position unknown
+                k = 0
+                for C in path.ops:
+                    x0, y0 = x, y
+                    x, y = coords[k], coords[k+1]
+                    k += NARGS[C]
+                    if C == LINE:
+                        pd.append(f"{x:.0f},{y:.0f}")
+                        continue
+                    if pd:
+                        f.write("PD" + ",".join(pd) + ";\n")
+                        pd = []
+                    if C == MOVE:
+                        f.write(f"PU{x:.0f},{y:.0f};\n")
+                    elif C == CURVE:
+                        x1, y1, x2, y2 = coords[k-4:k]
+                        arc = bezier_arc(x0, y0, x1, y1, x2, y2, x, y,
+                                         1e-3 * self.scale)
+                        if arc:
+                            cx, cy, sweep = arc
+                            f.write(f"PD;AA{cx:.0f},{cy:.0f},{math.degrees(sweep):.3f};\n")
                         else:
-                            sh = ET.SubElement(children, "Shape", Type="Text", CutIndex=str(fontColor), Font=f"{f}", H=f"{(params['fs']*1.75*0.6086434):.3f}", Str=f"{text}", Bold=f"{'1' if bold else '0'}", Italic=f"{'1' if italic else '0'}", Ah=f"{str(hor)}", Av=f"{str(ver)}", Eval=f"{texttype}", VariableOffset=f"{str(offs)}")  # 1mm = 1.75 Lightburn H units
-                            sh.text = "\n  "
-                            sh.tail = "\n"
-                            xf = ET.SubElement(sh, "XForm")
-                            xf.text = " ".join(f"{m[i]:.3f}" for i in (0, 3, 1, 4, 2, 5))
-                            xf.tail = "\n"
-                    else:
-                        if self.dbg: print ("4", num)
-                        print ("next, because not M")
-                        num += 1
+                            pd.extend(f"{px:.0f},{py:.0f}" for px, py in bezier_points(
+                                x0, y0, x1, y1, x2, y2, x, y, flatness))
+                    elif C == ARC:
+                        cx, cy, qx, qy = coords[k-4:k]
+                        sweep = arc_sweep(x0, y0, cx, cy, qx, qy)
+                        f.write(f"PD;AA{cx:.0f},{cy:.0f},{math.degrees(sweep):.3f};\n")
+                    elif C == TEXT:
+                        m, text, params = next(texts)
+                        x, y = x0, y0
+                        if self.pens.get(color_name(params["rgb"])):
+                            self._text(f, m, text, params)
+                            if not math.isnan(x):
+                                f.write(f"PU{x:.0f},{y:.0f};\n")
+                if pd:
+                    f.write("PD" + ",".join(pd) + ";\n")
+        f.write("PU;SP0;\n")
+        f.close()
+
+
+class BoxGeomSurface(Surface):
+    """Writes the recorded geometry to a binary .boxgeom file
+
+    The drawing is stored as recorded - before the coordinates are
+    adjusted for any output format - and can be written in every other
+    format later with load() (``boxes convert``). Little endian layout:
+
+    * header (see HEADER): magic, version, number of parts and paths,
+      offset and size of the sections below
+    * number of paths of each part (uint32)
+    * for each path: number of commands, number of coordinates, index of
+      the stroke params and number of texts (4 x uint32)
+    * opcodes of all paths back to back (see Path.ops)
+    * coordinates of all paths back to back (float64, 8 byte aligned)
+    * tables: the stroke params and the (matrix, text, params index)
+      tuples of all texts as Python literal (UTF-8)
+    * metadata of the drawing and the inner_corners setting (JSON)
+    """
+
+    MAGIC = b"BOXGEOM\0"
+    VERSION = 1
+    # magic, version, parts, paths, unused, then offset and size of the
+    # opcodes, coordinates, tables and metadata
+    HEADER = struct.Struct("<8sIIII8Q")
+
+    def finish(self, inner_corners="loop"):
+        parts = self.parts
+        paths = [path for part in parts for path in part.pathes]
+        params: dict[Any, int] = {}
+        texts = []
+        table = array("I")
+        for path in paths:
+            n = params.setdefault(params_key(path.params), len(params))
+            table.extend((len(path.ops), len(path.coords), n, len(path.texts)))
+            for m, text, tparams in path.texts:
+                n = params.setdefault(params_key(tparams), len(params))
+                texts.append((tuple(m[:6]), text, n))
+        counts = array("I", (len(part.pathes) for part in parts))
+        tables = repr(([dict(key) for key in params], texts)).encode("utf-8")
+        meta = json.dumps({"metadata": getattr(self, "metadata", {}),
+                           "inner_corners": inner_corners}).encode("utf-8")
+        if sys.byteorder == "big":
+            table.byteswap()
+            counts.byteswap()
+
+        ops_offset = self.HEADER.size + 4 * len(counts) + 4 * len(table)
+        ops_size = sum(len(path.ops) for path in paths)
+        coords_offset = (ops_offset + ops_size + 7) // 8 * 8
+        coords_count = sum(len(path.coords) for path in paths)
+        tables_offset = coords_offset + 8 * coords_count
+        meta_offset = tables_offset + len(tables)
+
+        with open(self._fname, "wb") as f:
+            f.write(self.HEADER.pack(
+                self.MAGIC, self.VERSION, len(parts), len(paths), 0,
+                ops_offset, ops_size, coords_offset, coords_count,
+                tables_offset, len(tables), meta_offset, len(meta)))
+            f.write(counts)
+            f.write(table)
+            for path in paths:
+                f.write(path.ops)
+            f.write(b"\0" * (coords_offset - ops_offset - ops_size))
+            for path in paths:
+                if sys.byteorder == "big":
+                    coords = array("d", path.coords)
+                    coords.byteswap()
+                    f.write(coords)
+                else:
+                    f.write(path.coords)
+            f.write(tables)
+            f.write(meta)
+
+    @classmethod
+    def load(cls, fname, surface_class=None):
+        """Return the drawing in the .boxgeom file fname
+
+        The file is mapped into memory. The coordinates of the paths are
+        views into the mapping - not copies. Changing them (as finish()
+        does) leaves the file untouched.
+
+        :param surface_class: class of the returned surface - so it can
+                              be written in its format without a copy
+        """
+        with open(fname, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        data = memoryview(mm)
+        (magic, version, nparts, npaths, _,
+         ops_offset, ops_size, coords_offset, coords_count,
+         tables_offset, tables_size, meta_offset, meta_size) = \
+            cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{fname} is not a .boxgeom file")
+        if version > cls.VERSION:
+            raise ValueError(f"{fname}: unsupported .boxgeom version {version}")
+
+        pos = cls.HEADER.size
+        counts = array("I", bytes(data[pos:pos + 4 * nparts]))
+        pos += 4 * nparts
+        table = array("I", bytes(data[pos:pos + 16 * npaths]))
+        ops = data[ops_offset:ops_offset + ops_size]
+        coords = data[coords_offset:coords_offset + 8 * coords_count]
+        if sys.byteorder == "big":
+            counts.byteswap()
+            table.byteswap()
+            coords = array("d", bytes(coords))
+            coords.byteswap()
+        else:
+            coords = coords.cast("d")
+        params, texts = ast.literal_eval(
+            str(data[tables_offset:tables_offset + tables_size], "utf-8"))
+        meta = json.loads(str(data[meta_offset:meta_offset + meta_size], "utf-8"))
+
+        surface = (surface_class or cls)(fname)
+        surface.parts = []
+        surface.set_metadata(meta["metadata"])
+        surface.inner_corners = meta["inner_corners"]
+        texts = iter(texts)
+        n = o = c = 0
+        for count in counts:
+            part = Part("part")
+            pathes = []
+            for _ in range(count):
+                nops, ncoords, nparams, ntexts = table[4*n:4*n+4]
+                path = Path.__new__(Path)
+                path.params = dict(params[nparams])
+                path.ops = bytearray(ops[o:o+nops])
+                path.coords = coords[c:c+ncoords]
+                path.texts = [(Affine(*m), text, dict(params[k]))
+                              for m, text, k in islice(texts, ntexts)]
+                path._last = ncoords - NARGS[path.ops[-1]] if nops else 0
+                path._bbox = None
+                pathes.append(path)
+                n += 1
+                o += nops
+                c += ncoords
+            part.set_pathes(pathes)
+            surface.parts.append(part)
+        surface._p = surface.parts[-1] if surface.parts else surface.new_part()
+        surface.count = ops_size
+        return surface
 
-        url = self.metadata["url"].replace("&render=1", "") # remove render argument to get web form again
-        
-        pl = ET.SubElement(svg, "Notes", ShowOnLoad="1", Notes="File created by Boxes.py script, programmed by Florian Festi.\nLightburn output by Klaus Steinhammer.\n\nURL with settings:\n" + str(url))
-        pl.text = ""
-        pl.tail = "\n"
 
-        if self.dbg: print ("5", num)
-        tree.write(open(self._fname, "wb"), encoding="utf-8", xml_declaration=True, method="xml")
 from random import random
 
 
@@ -1023,3 +2841,87 @@ def line_intersection(line1, line2):
     )
 
     return min(on_segments), x, y
+
+
+def bezier_arc(x0, y0, x1, y1, x2, y2, x3, y3, tolerance=1e-3):
+    """Return (cx, cy, sweep) if the cubic Bézier is a circular arc
+
+    The sweep angle is in radians and positive for counter clockwise
+    arcs. Returns None for all other curves. Finds the usual
+    approximations of arcs of up to 180°.
+    """
+    tx0, ty0 = x1 - x0, y1 - y0
+    tx3, ty3 = x3 - x2, y3 - y2
+    det = tx0 * ty3 - ty0 * tx3
+    if abs(det) < 1e-12:  # parallel tangents
+        return None
+    # the center is where the normals at both ends meet
+    s = (ty3 * (y3 - y0) + tx3 * (x3 - x0)) / det
+    cx, cy = x0 - s * ty0, y0 + s * tx0
+    r = math.hypot(x0 - cx, y0 - cy)
+    if r < tolerance or abs(math.hypot(x3 - cx, y3 - cy) - r) > tolerance:
+        return None
+    ax, ay, bx, by = x0 - cx, y0 - cy, x3 - cx, y3 - cy
+    sweep = math.atan2(ax * by - ay * bx, ax * bx + ay * by)
+    # the curve has to leave the start point around the center
+    if sweep * (tx0 * (cy - y0) - ty0 * (cx - x0)) <= 0:
+        return None
+    handle = 4 / 3 * math.tan(abs(sweep) / 4) * r
+    if (abs(math.hypot(tx0, ty0) - handle) > tolerance or
+        abs(math.hypot(tx3, ty3) - handle) > tolerance):
+        return None
+    mx = (x0 + 3 * x1 + 3 * x2 + x3) / 8
+    my = (y0 + 3 * y1 + 3 * y2 + y3) / 8
+    if abs(math.hypot(mx - cx, my - cy) - r) > tolerance:
+        return None
+    return cx, cy, sweep
+
+
+def bezier_points(x0, y0, x1, y1, x2, y2, x3, y3, flatness):
+    """Return points of a polyline deviating at most flatness from the
+    cubic Bézier. The start point is not included."""
+    ddx = max(abs(x0 - 2 * x1 + x2), abs(x1 - 2 * x2 + x3))
+    ddy = max(abs(y0 - 2 * y1 + y2), abs(y1 - 2 * y2 + y3))
+    n = max(1, math.ceil(math.sqrt(0.75 * math.hypot(ddx, ddy) / flatness)))
+    points = []
+    for i in range(1, n + 1):
+        t = i / n
+        u = 1 - t
+        a, b, c, d = u * u * u, 3 * u * u * t, 3 * u * t * t, t * t * t
+        points.append((a * x0 + b * x1 + c * x2 + d * x3,
+                       a * y0 + b * y1 + c * y2 + d * y3))
+    return points
+
+
+def arc_sweep(x0, y0, cx, cy, qx, qy):
+    """Return the sweep angle of an ARC in radians
+
+    The arc goes from x0, y0 around the center cx, cy and passes qx, qy
+    after a quarter of the sweep. Positive for counter clockwise arcs.
+    """
+    ax, ay, bx, by = x0 - cx, y0 - cy, qx - cx, qy - cy
+    return 4 * math.atan2(ax * by - ay * bx, ax * bx + ay * by)
+
+
+def arc_beziers(x0, y0, x, y, cx, cy, qx, qy):
+    """Return cubic Béziers of up to 90° approximating the ARC
+
+    Each is an (x1, y1, x2, y2, x3, y3) tuple of the control points and
+    the end point.
+    """
+    sweep = arc_sweep(x0, y0, cx, cy, qx, qy)
+    r = math.hypot(x0 - cx, y0 - cy)
+    a = math.atan2(y0 - cy, x0 - cx)
+    n = max(1, math.ceil(abs(sweep) / (0.5 * math.pi) - EPS))
+    da = sweep / n
+    k = 4 / 3 * math.tan(da / 4) * r
+    curves = []
+    for i in range(n):
+        x3, y3 = ((x, y) if i == n - 1 else
+                  (cx + r * math.cos(a + da), cy + r * math.sin(a + da)))
+        curves.append((x0 - k * math.sin(a), y0 + k * math.cos(a),
+                       x3 + k * math.sin(a + da), y3 - k * math.cos(a + da),
+                       x3, y3))
+        x0, y0 = x3, y3
+        a += da
+    return curves
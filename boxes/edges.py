@@ -16,11 +16,12 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import inspect
 import math
 import re
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, cast
 
 from boxes import gears
 
@@ -161,9 +162,15 @@ class Settings:
     Overload the absolute_params and relative_params class attributes with
     the supported keys and default values. The values are available via
     attribute access.
+
+    Settings objects made with shared() are frozen. There is only one of
+    them for the same arguments, so they can be used by several edges
+    and generators.
     """
     absolute_params: dict[str, Any] = {}  # TODO find better typing.
     relative_params: dict[str, Any] = {}  # TODO find better typing.
+    # kept out of __dict__ as they are no values (see memoKey())
+    __slots__ = ("__dict__", "__weakref__", "_frozen", "_memo_key")
 
     @classmethod
     def parserArguments(cls, parser, prefix=None, **defaults):
@@ -213,22 +220,50 @@ class Settings:
                                help=descriptions.get(name))
 
     def __init__(self, thickness, relative: bool = True, **kw) -> None:
-        self.values = {}
-        for name, value in self.absolute_params.items():
-            if isinstance(value, tuple):
-                value = value[0]
-            if type(value) not in (bool, int, float, str):
-                raise ValueError("Type not supported: %r", value)
-            self.values[name] = value
-
-        self.thickness = thickness
+        object.__setattr__(self, "_frozen", False)
+        object.__setattr__(self, "_memo_key", None)
+        values = self._defaults()[0].copy()
         factor = 1.0
         if relative:
             factor = thickness
         for name, value in self.relative_params.items():
-            self.values[name] = value * factor
+            values[name] = value * factor
+        d = self.__dict__
+        d["values"] = values
+        d["thickness"] = thickness
         self.setValues(thickness, relative, **kw)
 
+    @classmethod
+    def _defaults(cls):
+        """Checked default values of the absolute_params and the names of
+        the values that become attributes - worked out once per class"""
+        defaults = cls.__dict__.get("_checked_defaults")
+        if defaults is None:
+            values = {}
+            for name, value in cls.absolute_params.items():
+                if isinstance(value, tuple):
+                    value = value[0]
+                if type(value) not in (bool, int, float, str):
+                    raise ValueError("Type not supported: %r", value)
+                values[name] = value
+            names = tuple(name for name in {**values, **cls.relative_params}
+                          if name != "thickness" and not hasattr(cls, name))
+            defaults = cls._checked_defaults = (values, names)
+        return defaults
+
+    @classmethod
+    def shared(cls, thickness, relative: bool = True, **kw):
+        """
+        Frozen Settings object - the same one for the same arguments
+
+        Takes the same arguments as creating a new object. Setting values
+        of the result raises an AttributeError.
+        """
+        # classes are hashable - whatever mypy thinks of their __hash__
+        return _shared_settings(
+            cast(Any, cls), cast(Any, type(thickness)), thickness, relative,
+            tuple([(name, type(value), value) for name, value in kw.items()]))
+
     def edgeObjects(self, boxes, chars: str = "", add: bool = True):
         """
         Generate Edge objects using this kind of settings
@@ -261,6 +296,9 @@ class Settings:
         :param relative: Do scale by thickness (Default value = True)
         :param kw: parameters to set
         """
+        if self._frozen:
+            raise AttributeError(f"{type(self).__name__} object is frozen")
+        object.__setattr__(self, "_memo_key", None)
         factor = 1.0
         if relative:
             factor = thickness
@@ -271,6 +309,10 @@ class Settings:
                 self.values[name] = value * factor
             else:
                 raise ValueError(f"Unknown parameter for {self.__class__.__name__}: {name}")
+        # make the values plain attributes that don't need __getattr__
+        values = self.values
+        self.__dict__.update({name: values[name]
+                              for name in self._defaults()[1]})
         self.checkValues()
 
     def checkValues(self) -> None:
@@ -284,21 +326,162 @@ class Settings:
             return self.values[name]
         raise AttributeError
 
+    def __setattr__(self, name, value) -> None:
+        if self._frozen:
+            raise AttributeError(f"{type(self).__name__} object is frozen")
+        object.__setattr__(self, "_memo_key", None)
+        super().__setattr__(name, value)
+
+    def __setstate__(self, state) -> None:
+        # copies (e.g. with copy.deepcopy()) can be changed again
+        object.__setattr__(self, "_frozen", False)
+        object.__setattr__(self, "_memo_key", None)
+        if isinstance(state, tuple):  # __dict__ and slots
+            state = state[0]
+        self.__dict__.update(state or {})
+
+    def memoKey(self):
+        """Value that is equal for settings drawing the same (see memoized())
+
+        Worked out again only after setting a value of this object.
+        """
+        key = self._memo_key
+        if key is None:
+            key = (type(self), tuple([item for item in self.__dict__.items()
+                                      if item[0] != "values"]))
+            object.__setattr__(self, "_memo_key", key)
+        return key
+
+
+@functools.lru_cache(maxsize=256)
+def _shared_settings(cls, thickness_type, thickness, relative, kw):
+    """Frozen Settings objects made by Settings.shared()"""
+    settings = cls(thickness, relative,
+                   **{name: value for name, _, value in kw})
+    object.__setattr__(settings, "_frozen", True)
+    return settings
+
+
+#############################################################################
+### Memoized edges
+#############################################################################
+
+def _argument_key(value):
+    """Hashable value of an argument of a memoized edge call"""
+    if isinstance(value, BoltPolicy):
+        return (type(value), tuple(sorted(value.__dict__.items())))
+    return value
+
+
+def memoized(func=None, *, attributes=(), generator_attributes=()):
+    """Decorator for the __call__ method - or other methods taking the
+    length first - of edge classes that draw the same whenever they get
+    the same arguments
+
+    Calls with the same length, other arguments, settings, burn and tabs
+    replay the context calls recorded the first time (see
+    Context.replay()) instead of calculating everything again. Names of
+    further attributes of the edge and of the generator the drawing
+    depends on can be given as attributes and generator_attributes.
+    Edges must only draw - no callbacks, random numbers or changes of
+    the generator. Subclasses that do more can set the memoize
+    class attribute to False.
+
+    The recorded calls are kept in the generator and are dropped with
+    it. Results of calls that can't be replayed elsewhere (see
+    Context.stop_recording()) are not kept.
+    """
+    if func is None:
+        return functools.partial(memoized, attributes=attributes,
+                                 generator_attributes=generator_attributes)
+
+    @functools.wraps(func)
+    def __call__(self, length, *args, **kw):
+        memo = self.boxes.__dict__.get("_edge_memo")
+        if memo is None or not self.memoize:
+            return func(self, length, *args, **kw)
+        boxes = self.boxes
+        key = (func, type(self), length, self.settings.memoKey(),
+               boxes.burn, boxes.tabs,
+               tuple([getattr(self, name) for name in attributes]),
+               tuple([getattr(boxes, name) for name in generator_attributes]),
+               tuple([_argument_key(v) for v in args]),
+               tuple([(k, _argument_key(v)) for k, v in kw.items()]))
+        try:
+            calls = memo.get(key)
+        except TypeError:  # unhashable argument
+            return func(self, length, *args, **kw)
+        if calls is not None:
+            self.ctx.replay(calls)
+            return None
+
+        start = self.ctx.start_recording()
+        try:
+            result = func(self, length, *args, **kw)
+        finally:
+            calls = self.ctx.stop_recording(start)
+        if result is None and calls is not None:
+            memo[key] = calls
+        return result
+
+    return __call__
+
 
 #############################################################################
 ### Edges
 #############################################################################
 
+# Methods of the Boxes class edges and other helper classes use as if
+# they were their own
+TURTLE_METHODS = (
+    "bedBoltHole", "cc", "corner", "curveTo", "edge", "hole", "move",
+    "moveArc", "moveTo", "mountingHole", "polyline", "rectangularHole",
+    "rectangularWall", "saved_context", "set_source_color", "step", "text")
+
+
+def bind_turtle(obj, boxes, names=TURTLE_METHODS) -> None:
+    """Store the bound methods of boxes with the given names in obj
+
+    Calls then find them right away instead of going through
+    obj.__getattr__ - which is only tried after the regular lookup
+    failed. Names the class of obj has itself are left alone.
+    """
+    cls = type(obj)
+    if names is TURTLE_METHODS:
+        # looked up once per class
+        names = cls.__dict__.get("_turtle_methods")
+        if names is None:
+            names = tuple(name for name in TURTLE_METHODS
+                          if not hasattr(cls, name))
+            cls._turtle_methods = names
+    else:
+        names = [name for name in names if not hasattr(cls, name)]
+    # bound once per Boxes object
+    methods = boxes.__dict__.get("_bound_turtle_methods")
+    if methods is None:
+        methods = boxes.__dict__["_bound_turtle_methods"] = {
+            name: getattr(boxes, name) for name in TURTLE_METHODS}
+    d = obj.__dict__
+    if len(names) == len(TURTLE_METHODS):
+        d.update(methods)
+    else:
+        for name in names:
+            d[name] = methods[name]
+
 
 class BaseEdge(ABC):
     """Abstract base class for all Edges"""
     char: str | None = None
     description: str = "Abstract Edge Class"
+    # replay earlier calls of a memoized() __call__ method. Set to False
+    # in subclasses that do more than drawing the same lines
+    memoize = True
 
     def __init__(self, boxes, settings) -> None:
         self.boxes = boxes
         self.ctx = boxes.ctx
         self.settings = settings
+        bind_turtle(self, boxes)
 
     def __getattr__(self, name):
         """Hack for using unalter code form Boxes class"""
@@ -782,7 +965,7 @@ class SlottedEdge(BaseEdge):
     description = "Straight Edge with slots"
 
     def __init__(self, boxes, sections, edge: str = "e", slots: int = 0) -> None:
-        super().__init__(boxes, Settings(boxes.thickness))
+        super().__init__(boxes, Settings.shared(boxes.thickness))
 
         self.edge = self.edges.get(edge, edge)
         self.sections = sections
@@ -944,6 +1127,7 @@ class FingerJointEdge(BaseEdge, FingerJointBase):
         else:
             self.polyline(0, 90, h, -90, f, -90, h, 90)
 
+    @memoized(generator_attributes=("bedBoltSettings",))
     def __call__(self, length, bedBolts=None, bedBoltSettings=None, **kw):
 
         positive = self.positive
@@ -1182,16 +1366,20 @@ class StackableBaseEdge(BaseEdge):
 
     def __call__(self, length, **kw):
         s = self.settings
-        r = s.height / 2.0 / (1 - math.cos(math.radians(s.angle)))
-        l = r * math.sin(math.radians(s.angle))
-        p = 1 if self.bottom else -1
-
         if self.bottom and s.bottom_stabilizers:
             with self.saved_context():
                 sp = self.boxes.spacing
                 self.moveTo(-sp / 2, -s.height - sp)
                 self.rectangularWall(length - 1.05 * self.boxes.thickness,
                                      s.bottom_stabilizers)
+        self._feet(length)
+
+    @memoized
+    def _feet(self, length):
+        s = self.settings
+        r = s.height / 2.0 / (1 - math.cos(math.radians(s.angle)))
+        l = r * math.sin(math.radians(s.angle))
+        p = 1 if self.bottom else -1
 
         self.boxes.edge(s.width, tabs=1)
         self.boxes.corner(p * s.angle, r)
@@ -1504,6 +1692,7 @@ class HingePin(BaseEdge):
 
         return l
 
+    @memoized(attributes=("layout",))
     def __call__(self, l, **kw):
         plen = getattr(self, self.settings.style + 'len', self.outsetlen)()
         glen = l * self.settings.grip_percentage / 100 + \
@@ -2281,6 +2470,7 @@ class DoveTailJoint(BaseEdge):
     description = "Dove Tail Joint"
     positive = True
 
+    @memoized
     def __call__(self, length, **kw):
         s = self.settings
         radius = max(s.radius, self.boxes.burn)  # no smaller than burn
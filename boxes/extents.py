@@ -17,6 +17,16 @@ class Extents:
         for x, y in l:
             self.add(x, y)
 
+    def update(self, extent) -> None:
+        """Grow in place to also cover extent"""
+        self.xmin = min(self.xmin, extent.xmin)
+        self.ymin = min(self.ymin, extent.ymin)
+        self.xmax = max(self.xmax, extent.xmax)
+        self.ymax = max(self.ymax, extent.ymax)
+
+    def copy(self) -> "Extents":
+        return Extents(self.xmin, self.ymin, self.xmax, self.ymax)
+
     def __add__(self, extent):
         # todo: why can this happen?
         if extent == 0:
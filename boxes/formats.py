@@ -19,27 +19,30 @@ import os
 import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
 
-from boxes.drawing import SVGSurface, PSSurface, LBRN2Surface, Context
+from boxes.drawing import (SVGSurface, PSSurface, LBRN2Surface, DXFSurface, PDFSurface,
+                           GCodeSurface, HPGLSurface, BoxGeomSurface, Context)
 
 
 class Formats:
 
     pstoedit_candidates = ["/usr/bin/pstoedit", "pstoedit", "pstoedit.exe"]
-    ps2pdf_candidates = ["/usr/bin/ps2pdf", "ps2pdf", "ps2pdf.exe"]
 
-    _BASE_FORMATS = ['svg', 'svg_Ponoko', 'ps', 'lbrn2']
+    _BASE_FORMATS = ['svg', 'svg_Ponoko', 'ps', 'lbrn2', 'dxf', 'pdf', 'gcode', 'plt', 'boxgeom']
 
     formats = {
         "svg": None,
         "svg_Ponoko": None,
         "ps": None,
         "lbrn2": None,
-        "dxf": "{pstoedit} -flat 0.1 -f dxf:-mm {input} {output}",
-        "gcode": "{pstoedit} -f gcode {input} {output}",
-        "plt": "{pstoedit} -f plot-hpgl {input} {output}",
+        "dxf": None,
+        "gcode": None,
+        "plt": None,
+        "boxgeom": None,
         # "ai": "{pstoedit} -f ps2ai {input} {output}",
-        "pdf": "{ps2pdf} -dEPSCrop {input} {output}",
+        "pdf": None,
     }
 
     http_headers = {
@@ -50,43 +53,117 @@ class Formats:
         "dxf": [('Content-type', 'image/vnd.dxf')],
         "plt": [('Content-type', ' application/vnd.hp-hpgl')],
         "gcode": [('Content-type', 'text/plain; charset=utf-8')],
+        "pdf": [('Content-type', 'application/pdf')],
+        "boxgeom": [('Content-type', 'application/octet-stream')],
 
         # "" : [('Content-type', '')],
     }
 
+    # number of processes writing several formats in parallel - None for
+    # one per CPU, 1 to write them one after another in this process
+    processes = 1
+    # minimal number of path commands to use several processes for
+    parallel_threshold = 20000
+
     def __init__(self) -> None:
         for cmd in self.pstoedit_candidates:
             self.pstoedit = shutil.which(cmd)
             if self.pstoedit:
                 break
-        for cmd in self.ps2pdf_candidates:
-            self.ps2pdf = shutil.which(cmd)
-            if self.ps2pdf:
-                break
+        # attributes set on the surfaces of each format (see setOptions())
+        self.options: dict[str, dict[str, Any]] = {
+            "svg_Ponoko": {"instances": False},
+        }
+
+    def setOptions(self, fmt, **kw):
+        """Set attributes of the surfaces writing fmt
+
+        E.g. setOptions("svg", compact=True, precision=2). Each format has
+        its own options - "svg_Ponoko" doesn't get the ones of "svg".
+        """
+        self.options.setdefault(fmt, {}).update(kw)
 
     def getFormats(self):
         if self.pstoedit:
             return sorted(self.formats.keys())
         return self._BASE_FORMATS
 
-    def getSurface(self, fmt, filename):
+    def getSurfaceClass(self, fmt):
         if fmt in ("svg", "svg_Ponoko"):
-            surface = SVGSurface(filename)
+            return SVGSurface
         elif fmt == "lbrn2":
-            surface = LBRN2Surface(filename)
+            return LBRN2Surface
+        elif fmt == "dxf":
+            return DXFSurface
+        elif fmt == "pdf":
+            return PDFSurface
+        elif fmt == "gcode":
+            return GCodeSurface
+        elif fmt == "plt":
+            return HPGLSurface
+        elif fmt == "boxgeom":
+            return BoxGeomSurface
         else:
-            surface = PSSurface(filename)
+            return PSSurface
 
+    def getSurface(self, fmt, filename):
+        surface = self.getSurfaceClass(fmt)(filename)
         ctx = Context(surface)
         return surface, ctx
 
+    def _write(self, surface, fmt, inner_corners, metadata):
+        for name, value in self.options.get(fmt, {}).items():
+            setattr(surface, name, value)
+        surface.finish(inner_corners)
+        self.convert(surface._fname, fmt, metadata)
+
+    def write(self, surface, outputs, inner_corners="loop", metadata=None):
+        """Write the drawing on surface to several files
+
+        :param surface: surface holding the drawing
+        :param outputs: list of (format, filename) pairs
+        :param inner_corners: passed to Surface.finish()
+        :param metadata: passed to convert()
+
+        The drawing is copied for every format but the first one of the
+        class of surface as finishing changes it in place. For large
+        drawings the formats are written in parallel processes if
+        processes is not 1.
+        """
+        surfaces = []
+        original = surface
+        for fmt, filename in outputs:
+            cls = self.getSurfaceClass(fmt)
+            if original is not None and original.__class__ is cls:
+                original._fname = filename
+                surfaces.append((original, fmt))
+                original = None
+            else:
+                surfaces.append((surface.copy(cls, filename), fmt))
+
+        workers = min(len(surfaces), self.processes or os.cpu_count() or 1)
+        if workers > 1 and surface.count >= self.parallel_threshold:
+            try:
+                pool = ProcessPoolExecutor(workers)
+            except (OSError, NotImplementedError):
+                pool = None  # no multiprocessing on this platform
+            if pool is not None:
+                with pool:
+                    jobs = [pool.submit(self._write, s, f, inner_corners, metadata)
+                            for s, f in surfaces]
+                    for job in jobs:
+                        job.result()
+                return
+
+        for s, f in surfaces:
+            self._write(s, f, inner_corners, metadata)
+
     def convert(self, filename, fmt, metadata=None):
 
         if fmt not in self._BASE_FORMATS:
             fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(filename))
             cmd = self.formats[fmt].format(
                 pstoedit=self.pstoedit,
-                ps2pdf=self.ps2pdf,
                 input=filename,
                 output=tmpfile).split()
 
@@ -15,7 +15,7 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from boxes import *
-from boxes.edges import FingerJointEdge
+from boxes.edges import FingerJointEdge, memoized
 
 
 class UnevenFingerJointEdge(FingerJointEdge):
@@ -24,6 +24,7 @@ class UnevenFingerJointEdge(FingerJointEdge):
     description = "Uneven Finger Joint"
     positive = True
 
+    @memoized(generator_attributes=("bedBoltSettings",))
     def __call__(self, length, bedBolts=None, bedBoltSettings=None, **kw):
         # copied from original
 
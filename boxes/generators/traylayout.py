@@ -51,7 +51,7 @@ The actual sizes and all other settings can be entered in the second step."""
         # Use empty open and close methods to avoid initializing the whole drawing infrastructure.
         pass
 
-    def close(self) -> None:
+    def close(self, formats=None) -> None:
         # Use empty open and close methods to avoid initializing the whole drawing infrastructure.
         pass
 
@@ -51,6 +51,9 @@ class Lid:
     def __init__(self, boxes, settings):
         self.boxes = boxes
         self.settings = settings
+        # settings take precedence - see __getattr__
+        edges.bind_turtle(self, boxes, [name for name in edges.TURTLE_METHODS
+                                        if not hasattr(settings, name)])
 
     def __getattr__(self, name):
         """Hack for using unalter code form Boxes class"""
@@ -197,8 +200,8 @@ class Lid:
 
     def chestSide(self, x, angle=0, move="", label=""):
         if "a" not in self.edges:
-            s = edges.FingerJointSettings(self.thickness, True,
-                                          finger=1.0, space=1.0)
+            s = edges.FingerJointSettings.shared(self.thickness, True,
+                                                 finger=1.0, space=1.0)
             s.edgeObjects(self, "aA.")
 
         t = self.thickness
@@ -218,8 +221,8 @@ class Lid:
 
     def chestTop(self, x, y, angle=0, callback=None, move=None, label=""):
         if "a" not in self.edges:
-            s = edges.FingerJointSettings(self.thickness, True,
-                                          finger=1.0, space=1.0)
+            s = edges.FingerJointSettings.shared(self.thickness, True,
+                                                 finger=1.0, space=1.0)
             s.edgeObjects(self, "aA.")
 
         t = self.thickness
@@ -1,6 +1,7 @@
 from math import *
 
 from boxes import vectors
+from boxes.edges import bind_turtle
 
 
 def arcOnCircle(spanning_angle, outgoing_angle, r=1.0):
@@ -12,6 +13,7 @@ def arcOnCircle(spanning_angle, outgoing_angle, r=1.0):
 class Parts:
     def __init__(self, boxes) -> None:
         self.boxes = boxes
+        bind_turtle(self, boxes)
 
     """
     def roundKnob(self, diameter, n=20, callback=None, move=""):
@@ -7,6 +7,9 @@ __all__ = [
     "RobotArmMu",
 ]
 
+from boxes.edges import bind_turtle
+
+
 class RobotArg:
 
     def __init__(self, includenone=False) -> None:
@@ -36,6 +39,7 @@ class _RobotArm:
         self.boxes = boxes
         self.servo = servo
         self.servo2 = servo2 or servo
+        bind_turtle(self, boxes)
 
     def __getattr__(self, name):
         """Hack for easy access of Boxes methods"""
@@ -0,0 +1,1018 @@
+# Copyright (C) 2013-2023 Florian Festi
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Post processing of the finished drawing for faster cutting"""
+from __future__ import annotations
+
+import math
+from typing import Any
+
+from boxes.drawing import (
+    ARC, CURVE, EPS, LINE, MOVE, NARGS, TEXT, Path, arc_sweep, bezier_points,
+    color_name, params_key, points_equal,
+)
+
+# order the colors are cut in - same as in GCodeSurface.profiles
+LAYER_ORDER = ["ETCHING", "ETCHING_DEEP", "INNER_CUT", "MAGENTA", "YELLOW",
+               "WHITE", "OUTER_CUT", "ANNOTATIONS"]
+
+
+def travel_distance(surface):
+    """Return the length of the moves between the cuts in mm
+
+    The paths are taken in the order they are written in - starting at
+    the origin.
+    """
+    x = y = 0.0
+    d = 0.0
+    for part in surface.parts:
+        for path in part.pathes:
+            coords = path.coords
+            k = 0
+            for op in path.ops:
+                if op == MOVE:
+                    d += math.hypot(coords[k] - x, coords[k+1] - y)
+                if op != TEXT:
+                    x, y = coords[k], coords[k+1]
+                k += NARGS[op]
+    return d
+
+
+def cut_length(surface):
+    """Return the length of all lines drawn in mm - texts left out"""
+    length = 0.0
+    for part in surface.parts:
+        for path in part.pathes:
+            coords = path.coords
+            x = y = 0.0
+            k = 0
+            for op in path.ops:
+                if op == LINE:
+                    length += math.hypot(coords[k] - x, coords[k+1] - y)
+                elif op == CURVE:
+                    for px, py in bezier_points(x, y, *coords[k+2:k+6],
+                                                *coords[k:k+2], 0.01):
+                        length += math.hypot(px - x, py - y)
+                        x, y = px, py
+                elif op == ARC:
+                    cx, cy, qx, qy = coords[k+2:k+6]
+                    length += (math.hypot(x - cx, y - cy) *
+                               abs(arc_sweep(x, y, cx, cy, qx, qy)))
+                if op != TEXT:
+                    x, y = coords[k], coords[k+1]
+                k += NARGS[op]
+    return length
+
+
+def pierce_count(surface):
+    """Return the number of times the laser has to start cutting"""
+    return sum(path.ops.count(MOVE)
+               for part in surface.parts for path in part.pathes)
+
+
+class _Item:
+    """Path to be ordered
+
+    Closed strokes can be entered at every corner (vertex) - open ones
+    at both ends. All other paths only at their start.
+    """
+
+    __slots__ = "path closed reversible bbox area vertices".split()
+
+    def __init__(self, path) -> None:
+        self.path = path
+        stroke = path.is_stroke()
+        x0, y0 = path.coords[0], path.coords[1]
+        x1, y1 = path.last_point()
+        self.closed = stroke and points_equal(x0, y0, x1, y1)
+        self.reversible = stroke and not self.closed
+        e = path.extents()
+        self.bbox = (e.xmin, e.ymin, e.xmax, e.ymax)
+        self.area = (e.xmax - e.xmin) * (e.ymax - e.ymin)
+        if self.closed:
+            # end points of all commands but the last one
+            coords = path.coords
+            self.vertices = [(coords[k], coords[k+1])
+                             for k in path.offsets()[:-1]]
+        else:
+            self.vertices = [(x0, y0), (x1, y1)]
+
+    def entries(self):
+        """Points to start at as (x, y, v) with v the vertex or direction"""
+        if self.closed:
+            return [(x, y, v) for v, (x, y) in enumerate(self.vertices)]
+        (x0, y0), (x1, y1) = self.vertices
+        if self.reversible:
+            return [(x0, y0, 0), (x1, y1, 1)]
+        return [(x0, y0, 0)]
+
+    def ends(self, v):
+        """Return start and end point when entered at v"""
+        if self.closed:
+            return self.vertices[v], self.vertices[v]
+        if v:
+            return self.vertices[1], self.vertices[0]
+        return self.vertices[0], self.vertices[1]
+
+    def result(self, v):
+        """The path entered at v"""
+        if v == 0:
+            return self.path
+        if self.closed:
+            return self.path.rotated(v)
+        return self.path.reversed()
+
+
+def _nearest_neighbour(items, x, y):
+    """Return [item, v] pairs always going to the closest item next
+
+    Uses a grid of all entry points to find the closest ones.
+    """
+    entries = [(ex, ey, i, v) for i, item in enumerate(items)
+               for ex, ey, v in item.entries()]
+    xmin = min(e[0] for e in entries)
+    ymin = min(e[1] for e in entries)
+    xmax = max(e[0] for e in entries)
+    ymax = max(e[1] for e in entries)
+    size = max(math.sqrt((xmax - xmin) * (ymax - ymin) / len(items)), 1.0)
+    nx = int((xmax - xmin) / size) + 1
+    ny = int((ymax - ymin) / size) + 1
+    grid: dict[tuple[int, int], list[Any]] = {}
+    cells: list[list[Any]] = [[] for item in items]  # cells of each item
+    for e in entries:
+        cell = grid.setdefault((int((e[0] - xmin) / size),
+                                int((e[1] - ymin) / size)), [])
+        cell.append(e)
+        cells[e[2]].append(cell)
+
+    result = []
+    for n in range(len(items)):
+        cx = min(max(int((x - xmin) / size), 0), nx - 1)
+        cy = min(max(int((y - ymin) / size), 0), ny - 1)
+        best = None
+        dist = math.inf
+        r = 0
+        # entries in ring r are at least this far away
+        r0 = max(xmin - x, x - xmax, ymin - y, y - ymax, 0.0)
+        while dist > max(r0, (r - 1) * size) and r <= nx + ny:
+            for i in range(cx - r, cx + r + 1):
+                for j in ((cy - r, cy + r) if abs(i - cx) < r and r
+                          else range(cy - r, cy + r + 1)):
+                    for e in grid.get((i, j), ()):
+                        d = math.hypot(e[0] - x, e[1] - y)
+                        if d < dist:
+                            best, dist = e, d
+            r += 1
+        i, v = best[2], best[3]
+        for cell in cells[i]:
+            cell[:] = [e for e in cell if e[2] != i]
+        result.append([items[i], v])
+        x, y = items[i].ends(v)[1]
+    return result
+
+
+def _two_opt(order, x, y, window=30, passes=5):
+    """Improve the order by reversing runs of up to window items"""
+    n = len(order)
+    starts = [item.ends(v)[0] for item, v in order]
+    ends = [item.ends(v)[1] for item, v in order]
+    flippable = [item.closed or item.reversible for item, v in order]
+
+    def dist(p1, p2):
+        return math.hypot(p1[0] - p2[0], p1[1] - p2[1])
+
+    for _ in range(passes):
+        improved = False
+        for i in range(n):
+            if not flippable[i]:
+                continue
+            prev = ends[i-1] if i else (x, y)
+            for j in range(i + 1, min(i + window, n)):
+                if not flippable[j]:
+                    break
+                old = dist(prev, starts[i])
+                new = dist(prev, ends[j])
+                if j + 1 < n:
+                    old += dist(ends[j], starts[j+1])
+                    new += dist(starts[i], starts[j+1])
+                if new < old - EPS:
+                    order[i:j+1] = [[item, v if item.closed else 1 - v]
+                                    for item, v in reversed(order[i:j+1])]
+                    s, e = starts[i:j+1], ends[i:j+1]
+                    starts[i:j+1], ends[i:j+1] = e[::-1], s[::-1]
+                    improved = True
+        if not improved:
+            break
+
+
+def _choose_starts(order, x, y):
+    """Start closed contours at the corner closest to their neighbours"""
+    for n, pair in enumerate(order):
+        item = pair[0]
+        if item.closed:
+            nxt = order[n+1][0].ends(order[n+1][1])[0] if n + 1 < len(order) else None
+            best = math.inf
+            for v, (vx, vy) in enumerate(item.vertices):
+                d = math.hypot(vx - x, vy - y)
+                if nxt:
+                    d += math.hypot(vx - nxt[0], vy - nxt[1])
+                if d < best:
+                    best, pair[1] = d, v
+        x, y = item.ends(pair[1])[1]
+
+
+def _order(items, x, y):
+    """Return [item, v] pairs ordered for short travel from x, y"""
+    order = _nearest_neighbour(items, x, y)
+    _two_opt(order, x, y)
+    _choose_starts(order, x, y)
+    return order
+
+
+def _groups(part):
+    """Return the items of the part grouped in the order to cut them
+
+    Colors are cut in the order of LAYER_ORDER. Within a color contours
+    within other closed contours are cut before these.
+    """
+    items = [_Item(path) for path in part.pathes]
+    closed = sorted((item for item in items if item.closed),
+                    key=lambda item: -item.area)
+    groups: dict[tuple[int, int], list[_Item]] = {}
+    for item in items:
+        xmin, ymin, xmax, ymax = item.bbox
+        depth = 0
+        for c in closed:
+            if c.area <= item.area:
+                break
+            if (c.bbox[0] < xmin + EPS and c.bbox[1] < ymin + EPS and
+                c.bbox[2] > xmax - EPS and c.bbox[3] > ymax - EPS):
+                depth += 1
+        layer = LAYER_ORDER.index(color_name(item.path.params["rgb"]))
+        groups.setdefault((layer, -depth), []).append(item)
+    return [groups[key] for key in sorted(groups)]
+
+
+def optimize_travel(surface):
+    """Reorder the paths to shorten the moves between the cuts
+
+    Per part the colors are cut in the order of LAYER_ORDER and inner
+    contours before the contours around them. Within these groups the
+    paths are ordered by nearest neighbour and then improved by 2-opt.
+    Closed contours start at the corner closest to the previous cut,
+    open paths may be reversed. The parts are taken closest first.
+
+    If this does not shorten the travel the parts and the paths within
+    the groups are kept in their original order instead - but the groups
+    are still cut in the order above. Returns the travel distance before
+    and after in mm.
+    """
+    before = travel_distance(surface)
+    old = list(surface.parts)
+    # original order with only the groups sorted
+    grouped = [(part, [item.path for items in _groups(part)
+                       for item in items]) for part in old]
+    parts = [part for part in surface.parts if part.pathes]
+    result = []
+    x = y = 0.0
+    while parts:
+        def distance(part):
+            e = part.extents()
+            return math.hypot(max(e.xmin - x, 0.0, x - e.xmax),
+                              max(e.ymin - y, 0.0, y - e.ymax))
+        part = min(parts, key=distance)
+        parts.remove(part)
+        result.append(part)
+        pathes = []
+        for items in _groups(part):
+            for item, v in _order(items, x, y):
+                pathes.append(item.result(v))
+                x, y = item.ends(v)[1]
+        part.set_pathes(pathes)
+    surface.parts = result + [part for part in surface.parts
+                              if not part.pathes]
+    after = travel_distance(surface)
+    optimized = [(part, part.pathes) for part in surface.parts]
+    surface.parts = old
+    for part, pathes in grouped:
+        part.set_pathes(pathes)
+    unoptimized = travel_distance(surface)
+    if after < unoptimized:
+        surface.parts = [part for part, pathes in optimized]
+        for part, pathes in optimized:
+            part.set_pathes(pathes)
+    else:
+        after = unoptimized
+    return before, after
+
+
+def inner_cuts_after_outer_cuts(surface):
+    """Return the number of parts cutting an INNER_CUT path after an
+    OUTER_CUT one - which optimize_travel() avoids"""
+    n = 0
+    for part in surface.parts:
+        outer = False
+        for path in part.pathes:
+            color = color_name(path.params["rgb"])
+            if color == "OUTER_CUT":
+                outer = True
+            elif color == "INNER_CUT" and outer:
+                n += 1
+                break
+    return n
+
+
+class _Segment:
+    """Straight line of a path on the line at angle a and distance rho
+    from the origin. It covers t0 to t1 along the line."""
+
+    __slots__ = "ux uy rho t0 t1".split()
+
+    def __init__(self, x0, y0, x1, y1) -> None:
+        l = math.hypot(x1 - x0, y1 - y0)
+        self.ux, self.uy = (x1 - x0) / l, (y1 - y0) / l
+        self.rho = self.ux * y0 - self.uy * x0
+        self.t0 = self.ux * x0 + self.uy * y0
+        self.t1 = self.t0 + l
+
+    def covered(self, other, tolerance):
+        """Return the part (t0, t1) of self that other also covers or None"""
+        # end points of other in the coordinates of self
+        cos = self.ux * other.ux + self.uy * other.uy
+        sin = self.ux * other.uy - self.uy * other.ux
+        # start point of other
+        ox = other.ux * other.t0 - other.uy * other.rho
+        oy = other.uy * other.t0 + other.ux * other.rho
+        a0 = self.ux * ox + self.uy * oy
+        d0 = self.ux * oy - self.uy * ox - self.rho
+        l = other.t1 - other.t0
+        a1, d1 = a0 + cos * l, d0 + sin * l
+        if a1 < a0:
+            a0, a1, d0, d1 = a1, a0, d1, d0
+        lo, hi = max(a0, self.t0), min(a1, self.t1)
+        if hi - lo <= tolerance:
+            return None
+        if a1 - a0 > EPS:
+            dlo = d0 + (d1 - d0) * (lo - a0) / (a1 - a0)
+            dhi = d0 + (d1 - d0) * (hi - a0) / (a1 - a0)
+        else:
+            dlo = dhi = d0
+        if abs(dlo) > tolerance or abs(dhi) > tolerance:
+            return None
+        return lo, hi
+
+
+class _LineIndex:
+    """Grid over the angle and the distance to the origin of lines
+
+    Segments on the same line land in the same cell - or a neighbouring
+    one if they are close to the border of their cell.
+    """
+
+    def __init__(self, size, tolerance) -> None:
+        # lines less than da apart in angle are less than tolerance apart
+        # within the drawing
+        self.da = tolerance / size
+        self.drho = 2 * tolerance
+        self.wa = 4 * self.da  # size of the cells
+        self.wrho = 4 * self.drho
+        self.n = math.ceil(math.pi / self.wa)
+        self.cells: dict[Any, dict[tuple[int, int], list[_Segment]]] = {}
+
+    def _rhos(self, i, rho):
+        j = math.floor(rho / self.wrho)
+        yield i, j
+        if rho - j * self.wrho < self.drho:
+            yield i, j - 1
+        if (j + 1) * self.wrho - rho < self.drho:
+            yield i, j + 1
+
+    def cells_of(self, seg):
+        """Return the cell to store seg in and all cells to search"""
+        a = math.atan2(seg.uy, seg.ux)
+        rho = seg.rho
+        if a < 0.0 or a >= math.pi:
+            # same line in the other direction
+            a, rho = a % math.pi, -rho
+        i = min(int(a / self.wa), self.n - 1)
+        search = list(self._rhos(i, rho))
+        # lines close to 0° and 180° are close, too
+        if a - i * self.wa < self.da:
+            search.extend(self._rhos(i - 1, rho) if i else
+                          self._rhos(self.n - 1, -rho))
+        if a > math.pi - self.da:
+            search.extend(self._rhos(0, -rho))
+        elif (i + 1) * self.wa - a < self.da:
+            search.extend(self._rhos(i + 1, rho))
+        return search[0], search
+
+    def add(self, key, cell, seg):
+        self.cells.setdefault(key, {}).setdefault(cell, []).append(seg)
+
+    def candidates(self, key, cells):
+        grid = self.cells.get(key, {})
+        for cell in cells:
+            yield from grid.get(cell, ())
+
+
+def _uncovered(t0, t1, covered, tolerance):
+    """Return the parts of t0 to t1 not within the covered intervals"""
+    result = []
+    for lo, hi in sorted(covered):
+        if lo - t0 > tolerance:
+            result.append((t0, lo))
+        t0 = max(t0, hi)
+    if t1 - t0 > tolerance:
+        result.append((t0, t1))
+    return result
+
+
+def _split_path(path, removed):
+    """Return the path as list of paths with the removed lines left out
+
+    removed maps command numbers of lines to the (t0, t1) pieces to keep
+    given as distance from the start of the line.
+    """
+    result: list[Path] = []
+    current = None
+    pos = None  # end of what has been drawn
+    coords = path.coords
+    x = y = 0.0
+    k = t = 0
+
+    def start(x, y):
+        nonlocal current, pos
+        if current is None or pos is None or not points_equal(*pos, x, y):
+            current = Path(dict(path.params))
+            current.append(MOVE, x, y)
+            result.append(current)
+
+    for i, op in enumerate(path.ops):
+        if op == TEXT:
+            if current is None:
+                current = Path(dict(path.params))
+                result.append(current)
+            current.append(TEXT, *coords[k:k+2], *path.texts[t])
+            t += 1
+        elif op == LINE and i in removed:
+            x1, y1 = coords[k], coords[k+1]
+            l = math.hypot(x1 - x, y1 - y)
+            for t0, t1 in removed[i]:
+                start(x + (x1 - x) * t0 / l, y + (y1 - y) * t0 / l)
+                pos = (x + (x1 - x) * t1 / l, y + (y1 - y) * t1 / l)
+                current.append(LINE, *pos)
+        elif op != MOVE:
+            start(x, y)
+            current.append(op, *coords[k:k+NARGS[op]])
+            pos = (coords[k], coords[k+1])
+        if op != TEXT:
+            x, y = coords[k], coords[k+1]
+        k += NARGS[op]
+    result = [p for p in result if len(p.ops) > 1 or p.texts]
+    # join the pieces of closed contours at their old start
+    if (len(result) > 1 and path.is_stroke() and
+        points_equal(*coords[0:2], *path.last_point()) and
+        points_equal(*result[0].coords[0:2], *coords[0:2]) and
+        points_equal(*result[-1].last_point(), *coords[0:2])):
+        result[-1].extend(result[0], 1)
+        result.pop(0)
+    return result
+
+
+def remove_double_cuts(surface, tolerance=0.01):
+    """Remove straight lines drawn on top of other lines of the same color
+
+    Parts placed edge to edge share lines that would otherwise be cut
+    twice. Overlaps are found with a grid over the angle and the
+    position of the lines and are removed from the lines drawn later.
+    Lines count as on top of each other if they are less than tolerance
+    apart. Curves and arcs are left alone.
+
+    Returns the length of all lines before and after in mm.
+    """
+    before = cut_length(surface)
+    e = surface.extents()
+    size = max(abs(e.xmin), abs(e.xmax), abs(e.ymin), abs(e.ymax), 1.0)
+    index = _LineIndex(size, tolerance)
+    for part in surface.parts:
+        pathes = []
+        changed = False
+        for path in part.pathes:
+            key = color_name(path.params["rgb"])
+            coords = path.coords
+            removed = {}
+            x = y = 0.0
+            k = 0
+            for i, op in enumerate(path.ops):
+                x1, y1 = coords[k], coords[k+1]
+                if op == LINE and not points_equal(x, y, x1, y1):
+                    seg = _Segment(x, y, x1, y1)
+                    cell, search = index.cells_of(seg)
+                    covered = []
+                    for other in index.candidates(key, search):
+                        c = seg.covered(other, tolerance)
+                        if c:
+                            covered.append(c)
+                    if covered:
+                        removed[i] = [
+                            (t0 - seg.t0, t1 - seg.t0) for t0, t1 in
+                            _uncovered(seg.t0, seg.t1, covered, tolerance)]
+                    index.add(key, cell, seg)
+                if op != TEXT:
+                    x, y = x1, y1
+                k += NARGS[op]
+            if removed:
+                pathes.extend(_split_path(path, removed))
+                changed = True
+            else:
+                pathes.append(path)
+        if changed:
+            part.set_pathes(pathes)
+    return before, cut_length(surface)
+
+
+def _end_point(path, end):
+    return path.last_point() if end else path.coords[0:2]
+
+
+class _PointGrid:
+    """Grid of points to find the ones on a line segment"""
+
+    def __init__(self, points) -> None:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        self.size = max(1.0, math.sqrt(
+            (max(xs) - min(xs)) * (max(ys) - min(ys)) / len(points)))
+        self.cells: dict[tuple[int, int], list[tuple[float, float]]] = {}
+        for x, y in points:
+            self.cells.setdefault(
+                (int(x // self.size), int(y // self.size)), []).append((x, y))
+
+    def on_line(self, x0, y0, x1, y1):
+        """Return (t, x, y) of the points on the line with 0 < t <= 1"""
+        s = self.size
+        i0, i1 = int((min(x0, x1) - EPS) // s), int((max(x0, x1) + EPS) // s)
+        j0, j1 = int((min(y0, y1) - EPS) // s), int((max(y0, y1) + EPS) // s)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            cells = [c for (i, j), c in self.cells.items()
+                     if i0 <= i <= i1 and j0 <= j <= j1]
+        else:
+            cells = [self.cells[i, j] for i in range(i0, i1 + 1)
+                     for j in range(j0, j1 + 1) if (i, j) in self.cells]
+        dx, dy = x1 - x0, y1 - y0
+        l2 = dx * dx + dy * dy
+        result = []
+        for cell in cells:
+            for x, y in cell:
+                if points_equal(x, y, x1, y1):
+                    result.append((1.0, x, y))
+                elif l2 > 0.0 and not points_equal(x, y, x0, y0):
+                    t = ((x - x0) * dx + (y - y0) * dy) / l2
+                    if (0.0 < t < 1.0 and abs((x - x0) * dy - (y - y0) * dx)
+                        < EPS * math.sqrt(l2)):
+                        result.append((t, x, y))
+        return result
+
+
+def _split_stroke(path, grid):
+    """Return the pieces of the stroke split where points of grid touch it
+
+    Splits at corners and within lines. Closed contours are split at
+    their start point only if a point is there.
+    """
+    ops, coords = path.ops, path.coords
+    closed = points_equal(*coords[0:2], *path.last_point())
+    ends = ((coords[0], coords[1]), path.last_point())
+    pieces = []
+    current = Path(dict(path.params))
+    current.append(MOVE, coords[0], coords[1])
+    x, y = coords[0], coords[1]
+    k = 2
+    cut_at_end = False
+    for op in ops[1:]:
+        x1, y1 = coords[k], coords[k+1]
+        if op == LINE:
+            cuts = sorted(grid.on_line(x, y, x1, y1))
+        else:
+            cuts = [(1.0, px, py) for t, px, py in grid.on_line(x1, y1, x1, y1)]
+        cut_at_end = False
+        for t, px, py in cuts:
+            if not closed and any(points_equal(px, py, *e) for e in ends):
+                continue
+            if t < 1.0:
+                current.append(LINE, px, py)
+            else:
+                current.append(op, *coords[k:k+NARGS[op]])
+                cut_at_end = True
+            pieces.append(current)
+            current = Path(dict(path.params))
+            current.append(MOVE, px, py)
+        if not cut_at_end:
+            current.append(op, *coords[k:k+NARGS[op]])
+        x, y = x1, y1
+        k += NARGS[op]
+    if len(current.ops) > 1:
+        pieces.append(current)
+    if closed and len(pieces) > 1 and not cut_at_end:
+        # the last piece continues at the start of the first one
+        pieces[-1].extend(pieces[0], 1)
+        pieces.pop(0)
+    return pieces
+
+
+def _chain(path, pathes, ends, used):
+    """Return the paths to append to path in the order to append them
+
+    Paths starting or ending at the end of path are taken from the
+    index ends and reversed if needed.
+    """
+    chain = []
+    pk = params_key(path.params)
+    x, y = path.last_point()
+    while True:
+        found = None
+        cx, cy = x // EPS, y // EPS
+        # points closer than EPS are at most one cell apart
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for pos, end in ends.get((cx + dx, cy + dy, pk), ()):
+                    if (not found and not used[pos] and points_equal(
+                            x, y, *_end_point(pathes[pos], end))):
+                        found = pos, end
+        if not found:
+            return chain
+        pos, end = found
+        used[pos] = True
+        p = pathes[pos]
+        chain.append(p.reversed() if end else p)
+        x, y = chain[-1].last_point()
+
+
+def join_paths(surface):
+    """Join lines meeting each other into longer lines
+
+    Lines are split where the end of an open line touches them - at a
+    corner or within a straight line. Then the open lines are chained
+    at their ends - reversing them if needed. Lines are joined across
+    parts - e.g. pieces left by remove_double_cuts() - and end up in the
+    part of the line the chain was built from. Only lines with the same
+    parameters (color, line width) are joined.
+
+    The drawing is left alone if this does not save pierces.
+    Returns the number of pierces (see pierce_count()) before and after.
+    """
+    before = pierce_count(surface)
+    old = [(part, part.pathes) for part in surface.parts]
+    open_ends: dict[Any, list[tuple[float, float]]] = {}
+    for part in surface.parts:
+        for path in part.pathes:
+            if path.is_stroke() and not points_equal(
+                    *path.coords[0:2], *path.last_point()):
+                open_ends.setdefault(params_key(path.params), []).extend(
+                    (path.coords[0:2], path.last_point()))
+    if not open_ends:
+        return before, before
+    grids = {pk: _PointGrid(points) for pk, points in open_ends.items()}
+
+    # (part number, path) with the strokes split
+    pathes = []
+    for n, part in enumerate(surface.parts):
+        for path in part.pathes:
+            grid = grids.get(params_key(path.params))
+            if grid and path.is_stroke():
+                pathes.extend((n, p) for p in _split_stroke(path, grid))
+            else:
+                pathes.append((n, path))
+
+    # (cell x, cell y, params) -> [(position, 0 for start/1 for end)]
+    ends: dict[Any, list[tuple[int, int]]] = {}
+    is_open = []
+    for pos, (n, path) in enumerate(pathes):
+        is_open.append(path.is_stroke() and not points_equal(
+            *path.coords[0:2], *path.last_point()))
+        if is_open[-1]:
+            pk = params_key(path.params)
+            for end in (0, 1):
+                x, y = _end_point(path, end)
+                ends.setdefault((x // EPS, y // EPS, pk), []).append((pos, end))
+    strokes = [path for n, path in pathes]
+    used = [False] * len(pathes)
+    result: list[list[Path]] = [[] for part in surface.parts]
+    for pos, (n, path) in enumerate(pathes):
+        if used[pos]:
+            continue
+        used[pos] = True
+        if is_open[pos]:
+            tail = _chain(path, strokes, ends, used)
+            head = _chain(path.reversed(), strokes, ends, used)
+            if tail or head:
+                # head was found walking backwards - turn it around
+                chain = [p.reversed() for p in reversed(head)] + [path] + tail
+                path = chain[0].copy()
+                for p in chain[1:]:
+                    path.extend(p, 1)
+        result[n].append(path)
+    for part, pathes in zip(surface.parts, result):
+        part.set_pathes(pathes)
+    after = pierce_count(surface)
+    if after >= before:
+        for part, pathes in old:
+            part.set_pathes(pathes)
+        after = before
+    return before, after
+
+
+def segment_count(surface):
+    """Return the number of lines, curves and arcs in the drawing"""
+    return sum(len(path.ops) - path.ops.count(MOVE) - path.ops.count(TEXT)
+               for part in surface.parts for path in part.pathes)
+
+
+# runs of lines turning more than this at a point are treated as separate
+# shapes - like the sides of a finger
+MAX_TURN = math.radians(30)
+
+
+def _segment_distance(px, py, x0, y0, x1, y1):
+    dx, dy = x1 - x0, y1 - y0
+    l2 = dx * dx + dy * dy
+    t = 0.0 if l2 == 0.0 else max(0.0, min(1.0, ((px-x0)*dx + (py-y0)*dy) / l2))
+    return math.hypot(px - x0 - t * dx, py - y0 - t * dy)
+
+
+def _douglas_peucker(pts, a, b, tolerance):
+    """Return the indices of the points between a and b to keep"""
+    keep = [a, b]
+    stack = [(a, b)]
+    while stack:
+        i, j = stack.pop()
+        (x0, y0), (x1, y1) = pts[i], pts[j]
+        dmax, kmax = 0.0, -1
+        for k in range(i + 1, j):
+            d = _segment_distance(*pts[k], x0, y0, x1, y1)
+            if d > dmax:
+                dmax, kmax = d, k
+        if dmax > tolerance:
+            keep.append(kmax)
+            stack.extend(((i, kmax), (kmax, j)))
+    return sorted(keep)
+
+
+def _straight(pts, i, j, tolerance):
+    """Whether the points i to j are within tolerance of the line i-j"""
+    (x0, y0), (x1, y1) = pts[i], pts[j]
+    return all(_segment_distance(*pts[k], x0, y0, x1, y1) <= tolerance
+               for k in range(i + 1, j))
+
+
+def _fit_arc(pts, i, j, tolerance, min_chord):
+    """Return center and sweep of an arc through the points i to j or None
+
+    The arc must stay within tolerance of all points and the lines in
+    between and turn the same way at each of them.
+    """
+    if j - i < 3:
+        return None
+    (x0, y0), (xm, ym), (x1, y1) = pts[i], pts[(i + j) // 2], pts[j]
+    if (math.hypot(x1 - x0, y1 - y0) <= min_chord or
+            _straight(pts, i, j, tolerance)):
+        return None
+    # circle through the first, middle and last point
+    ax, ay, bx, by = xm - x0, ym - y0, x1 - x0, y1 - y0
+    d = 2 * (ax * by - ay * bx)
+    if abs(d) < EPS * EPS:
+        return None
+    a2, b2 = ax * ax + ay * ay, bx * bx + by * by
+    cx = x0 + (by * a2 - ay * b2) / d
+    cy = y0 + (ax * b2 - bx * a2) / d
+    r = math.hypot(x0 - cx, y0 - cy)
+    sweep = 0.0
+    px, py = x0, y0
+    for k in range(i + 1, j + 1):
+        x, y = pts[k]
+        if (abs(math.hypot(x - cx, y - cy) - r) > tolerance or
+                abs(math.hypot((x + px) / 2 - cx, (y + py) / 2 - cy) - r)
+                > tolerance):
+            return None
+        ux, uy, vx, vy = px - cx, py - cy, x - cx, y - cy
+        step = math.atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+        if step * sweep < 0 or abs(step) > 0.5 * math.pi:
+            return None
+        sweep += step
+        px, py = x, y
+    if abs(sweep) > 1.5 * math.pi:
+        return None
+    return cx, cy, sweep
+
+
+def _bezier(u, p0, p1, p2, p3):
+    v = 1 - u
+    b0, b1, b2, b3 = v * v * v, 3 * u * v * v, 3 * u * u * v, u * u * u
+    return (b0 * p0[0] + b1 * p1[0] + b2 * p2[0] + b3 * p3[0],
+            b0 * p0[1] + b1 * p1[1] + b2 * p2[1] + b3 * p3[1])
+
+
+def _fit_bezier(pts, i, j, tolerance, min_chord):
+    """Return the control points of a cubic Bézier through the points i
+    to j or None
+
+    Least squares fit along the tangents at both ends (see Philip J.
+    Schneider: An Algorithm for Automatically Fitting Digitized Curves).
+    """
+    if j - i < 4:
+        return None
+    p0, p3 = pts[i], pts[j]
+    chord = math.hypot(p3[0] - p0[0], p3[1] - p0[1])
+    if chord <= min_chord or _straight(pts, i, j, tolerance):
+        return None
+    t1x, t1y = pts[i+1][0] - p0[0], pts[i+1][1] - p0[1]
+    t2x, t2y = pts[j-1][0] - p3[0], pts[j-1][1] - p3[1]
+    l1, l2 = math.hypot(t1x, t1y), math.hypot(t2x, t2y)
+    if l1 < EPS or l2 < EPS:
+        return None
+    t1x, t1y, t2x, t2y = t1x / l1, t1y / l1, t2x / l2, t2y / l2
+    # chord length parameters of the points
+    u = [0.0]
+    for k in range(i + 1, j + 1):
+        u.append(u[-1] + math.hypot(pts[k][0] - pts[k-1][0],
+                                    pts[k][1] - pts[k-1][1]))
+    u = [t / u[-1] for t in u]
+    c00 = c01 = c11 = x0 = x1 = 0.0
+    for t, (px, py) in zip(u, pts[i:j+1]):
+        v = 1 - t
+        b1, b2 = 3 * t * v * v, 3 * t * t * v
+        a1x, a1y, a2x, a2y = t1x * b1, t1y * b1, t2x * b2, t2y * b2
+        c00 += a1x * a1x + a1y * a1y
+        c01 += a1x * a2x + a1y * a2y
+        c11 += a2x * a2x + a2y * a2y
+        s0, s3 = v * v * v + b1, b2 + t * t * t
+        rx = px - (p0[0] * s0 + p3[0] * s3)
+        ry = py - (p0[1] * s0 + p3[1] * s3)
+        x0 += rx * a1x + ry * a1y
+        x1 += rx * a2x + ry * a2y
+    det = c00 * c11 - c01 * c01
+    alpha1 = alpha2 = chord / 3
+    if abs(det) > 1e-12:
+        alpha1 = (x0 * c11 - x1 * c01) / det
+        alpha2 = (c00 * x1 - c01 * x0) / det
+    if not (EPS < alpha1 < chord and EPS < alpha2 < chord):
+        return None
+    p1 = p0[0] + alpha1 * t1x, p0[1] + alpha1 * t1y
+    p2 = p3[0] + alpha2 * t2x, p3[1] + alpha2 * t2y
+    # the curve must pass close to every point and line in between
+    for k in range(1, len(u)):
+        px, py = pts[i+k-1]
+        x, y = pts[i+k]
+        bx, by = _bezier(u[k], p0, p1, p2, p3)
+        mx, my = _bezier(0.5 * (u[k-1] + u[k]), p0, p1, p2, p3)
+        if (math.hypot(bx - x, by - y) > tolerance or
+                _segment_distance(mx, my, px, py, x, y) > tolerance):
+            return None
+    return p1 + p2
+
+
+def _longest_fit(fit, pts, i, end, tolerance, min_chord):
+    """Return (j, fit result) for the longest fit from i to j <= end
+
+    Searches by doubling the length and then bisecting, assuming the fits
+    that fail do not get better with more points.
+    """
+    j = i + 3
+    if j > end:
+        return None
+    result = fit(pts, i, j, tolerance, min_chord)
+    if result is None:
+        j = i + 4  # Béziers need more points
+        if j > end:
+            return None
+        result = fit(pts, i, j, tolerance, min_chord)
+        if result is None:
+            return None
+    best, upper = (j, result), end + 1
+    while j < end:
+        j = min(i + 2 * (j - i), end)
+        result = fit(pts, i, j, tolerance, min_chord)
+        if result is None:
+            upper = j
+            break
+        best = (j, result)
+    lo = best[0]
+    while upper - lo > 1:
+        j = (lo + upper) // 2
+        result = fit(pts, i, j, tolerance, min_chord)
+        if result is None:
+            upper = j
+        else:
+            lo, best = j, (j, result)
+    return best
+
+
+def _turn(pts, k):
+    (x0, y0), (x1, y1), (x2, y2) = pts[k-1], pts[k], pts[k+1]
+    ax, ay, bx, by = x1 - x0, y1 - y0, x2 - x1, y2 - y1
+    return math.atan2(ax * by - ay * bx, ax * bx + ay * by)
+
+
+def _simplify_lines(path, pts, tolerance):
+    """Append the polyline pts (without its start) to path as fewer lines,
+    arcs and Bézier curves"""
+    unique = [pts[0]]
+    for p in pts[1:]:
+        if not points_equal(*p, *unique[-1]):
+            unique.append(p)
+    pts = unique
+    # keep short arcs and curves from being taken for loops at inner
+    # corners by Path.faster_edges()
+    min_chord = path.params["lw"]
+    n = len(pts) - 1
+    corners = [0] + [k for k in range(1, n)
+                     if abs(_turn(pts, k)) > MAX_TURN] + [n]
+
+    def lines(a, b):
+        if a == b:
+            return
+        for k in _douglas_peucker(pts, a, b, tolerance)[1:]:
+            path.append(LINE, *pts[k])
+
+    for a, b in zip(corners, corners[1:]):
+        i = start = a
+        while i < b:
+            arc = _longest_fit(_fit_arc, pts, i, b, tolerance, min_chord)
+            if arc:
+                j, (cx, cy, sweep) = arc
+                lines(start, i)
+                x0, y0 = pts[i]
+                a0 = math.atan2(y0 - cy, x0 - cx) + 0.25 * sweep
+                r = math.hypot(x0 - cx, y0 - cy)
+                path.append(ARC, *pts[j], cx, cy,
+                            cx + r * math.cos(a0), cy + r * math.sin(a0))
+                i = start = j
+                continue
+            curve = _longest_fit(_fit_bezier, pts, i, b, tolerance, min_chord)
+            if curve:
+                j, controls = curve
+                lines(start, i)
+                path.append(CURVE, *pts[j], *controls)
+                i = start = j
+                continue
+            i += 1
+        lines(start, b)
+
+
+def _simplify_path(path, tolerance):
+    """Return path with its runs of lines simplified"""
+    ops, coords = path.ops, path.coords
+    result = Path(path.params)
+    texts = iter(path.texts)
+    run: list[tuple[float, float]] = []
+    k = 0
+    for op in ops:
+        if op == LINE:
+            if not run:
+                run.append(result.last_point())
+            run.append((coords[k], coords[k+1]))
+        else:
+            if run:
+                _simplify_lines(result, run, tolerance)
+                run = []
+            result.append(op, *coords[k:k+NARGS[op]],
+                          *(next(texts) if op == TEXT else ()))
+        k += NARGS[op]
+    if run:
+        _simplify_lines(result, run, tolerance)
+    return result
+
+
+def simplify(surface, tolerance=0.01):
+    """Replace runs of lines by fewer lines, arcs and Bézier curves
+
+    Collinear lines are merged and polylines are simplified with the
+    Douglas-Peucker algorithm. Smooth runs - like the flanks of gear
+    teeth or polygons approximating circles - become arcs or curves.
+    The new lines stay within tolerance (in mm) of the old ones. Points
+    where the lines turn sharply - like the corners of fingers - are
+    kept. Lines in different paths are left alone.
+
+    Returns the number of lines, curves and arcs (see segment_count())
+    before and after.
+    """
+    before = segment_count(surface)
+    for part in surface.parts:
+        pathes = []
+        for path in part.pathes:
+            if bytes((LINE, LINE)) in path.ops:  # two lines in a row
+                path = _simplify_path(path, tolerance)
+            pathes.append(path)
+        part.set_pathes(pathes)
+    return before, segment_count(surface)
@@ -3,7 +3,7 @@ import math
 from typing import Any
 
 from boxes import Boxes, edges
-from .edges import Settings, BaseEdge
+from .edges import Settings, BaseEdge, memoized
 
 
 class _WallMountedBox(Boxes):
@@ -66,6 +66,7 @@ class WallEdge(BaseEdge):
     def _section(self, nr, length):
         self.edge(length)
 
+    @memoized
     def __call__(self, length, **kw):
         lengths = list(enumerate(self.lengths(length)))
         if self._reversed:
@@ -81,6 +82,7 @@ class WallEdge(BaseEdge):
 
 class WallJoinedEdge(WallEdge):
     char = "b"
+    memoize = False  # draws with the edges of the generator
 
     def _joint(self, length):
         t = self.settings.thickness
@@ -92,6 +94,7 @@ class WallJoinedEdge(WallEdge):
         return self.settings.thickness
 
 class WallBackEdge(WallEdge):
+    memoize = False  # draws with the edges of the generator
 
     def _section(self, nr, length):
         self.edge(length)
@@ -106,6 +109,7 @@ class WallBackEdge(WallEdge):
         return self.settings.thickness
 
 class WallHoles(WallEdge):
+    memoize = False  # draws holes
 
     def _section(self, nr, length):
         self.rectangularHole(length/2, 0, length, self.settings.thickness)